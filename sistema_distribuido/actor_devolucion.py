@@ -62,15 +62,38 @@ class ActorDevolucion:
             logger.error(f"Error conectando al Gestor de Carga: {e}")
             raise
     
+    def _datos_devolucion(self, evento):
+        """Extrae del evento los datos de la operación RETURN_BOOK para GA"""
+        libro_id = evento.get('libro_id', '')
+        usuario_id = evento.get('usuario_id', '')
+        sede = evento.get('sede', 'SEDE_1')
+        
+        logger.info(f"Procesando devolución: Libro {libro_id} - Usuario {usuario_id} - Sede {sede}")
+        
+        return {
+            "libro_id": libro_id,
+            "usuario_id": usuario_id,
+            "sede": sede
+        }
+    
+    def _registrar_resultado(self, resultado):
+        """Registra la respuesta de GA a una devolución; devuelve True si fue exitosa"""
+        if not resultado:
+            logger.error("Error comunicándose con GA para procesar devolución")
+            return False
+        
+        if resultado.get('success'):
+            self.contador_devoluciones += 1
+            logger.info(f"Devolución procesada exitosamente (#{self.contador_devoluciones}): {resultado.get('message')}")
+            return True
+        else:
+            logger.warning(f"Error en devolución: {resultado.get('message')}")
+            return False
+    
     def procesar_devolucion(self, evento):
         """Procesa un evento de devolución usando GA"""
         try:
-            libro_id = evento.get('libro_id', '')
-            usuario_id = evento.get('usuario_id', '')
-            sede = evento.get('sede', 'SEDE_1')
-            timestamp = evento.get('timestamp', '')
-            
-            logger.info(f"Procesando devolución: Libro {libro_id} - Usuario {usuario_id} - Sede {sede}")
+            datos = self._datos_devolucion(evento)
             
             # Verificar conexión con GA
             health = self.failover_manager.verificar_y_reconectar()
@@ -79,31 +102,34 @@ class ActorDevolucion:
                 return False
             
             # Enviar operación de devolución a GA
-            resultado = self.failover_manager.enviar_operacion(
-                "RETURN_BOOK",
-                {
-                    "libro_id": libro_id,
-                    "usuario_id": usuario_id,
-                    "sede": sede
-                }
-            )
-            
-            if not resultado:
-                logger.error("Error comunicándose con GA para procesar devolución")
-                return False
-            
-            if resultado.get('success'):
-                self.contador_devoluciones += 1
-                logger.info(f"Devolución procesada exitosamente (#{self.contador_devoluciones}): {resultado.get('message')}")
-                return True
-            else:
-                logger.warning(f"Error en devolución: {resultado.get('message')}")
-                return False
+            resultado = self.failover_manager.enviar_operacion("RETURN_BOOK", datos)
+            return self._registrar_resultado(resultado)
             
         except Exception as e:
             logger.error(f"Error procesando devolución: {e}")
             return False
     
+    def procesar_devoluciones(self, eventos):
+        """Procesa los eventos de un mismo mensaje enviándolos a GA como un lote en pipelining"""
+        if len(eventos) == 1:
+            self.procesar_devolucion(eventos[0])
+            return
+        
+        try:
+            operaciones = [("RETURN_BOOK", self._datos_devolucion(evento)) for evento in eventos]
+            
+            # Verificar conexión con GA una vez para todo el lote
+            health = self.failover_manager.verificar_y_reconectar()
+            if not health.get('ok'):
+                logger.error(f"GA no está disponible para procesar {len(eventos)} devoluciones")
+                return
+            
+            for resultado in self.failover_manager.enviar_lote(operaciones):
+                self._registrar_resultado(resultado)
+            
+        except Exception as e:
+            logger.error(f"Error procesando lote de devoluciones: {e}")
+    
     def escuchar_eventos(self):
         """Escucha eventos de devolución del Gestor de Carga"""
         logger.info("Iniciando escucha de eventos de devolución...")
@@ -113,22 +139,32 @@ class ActorDevolucion:
                 # Recibir mensaje (topic + datos)
                 mensaje = self.sub_socket.recv_multipart(zmq.NOBLOCK)
                 
-                if len(mensaje) >= 2:
-                    topic = mensaje[0].decode('utf-8')
-                    datos_json = mensaje[1].decode('utf-8')
+                # Con GC_PUB_BATCH=1 el GC agrupa varios eventos: [topic, evento1, evento2, ...]
+                topic = mensaje[0].decode('utf-8')
+                eventos = []
+                for datos_bytes in mensaje[1:]:
+                    datos_json = datos_bytes.decode('utf-8')
                     
                     logger.info(f"Evento recibido - Topic: {topic}")
                     logger.info(f"Datos: {datos_json}")
                     
                     # Parsear evento
-                    evento = json.loads(datos_json)
+                    try:
+                        evento = json.loads(datos_json)
+                    except json.JSONDecodeError as e:
+                        logger.error(f"Error parseando evento JSON: {e}")
+                        continue
                     
                     # Procesar solo eventos de devolución
                     if topic == "devolucion" and evento.get('operacion') == 'DEVOLUCION':
-                        self.procesar_devolucion(evento)
+                        eventos.append(evento)
                     else:
                         logger.warning(f"Evento inesperado recibido: {topic} - {evento.get('operacion', 'N/A')}")
                 
+                # Los eventos de un mismo mensaje van a GA en un solo lote
+                if eventos:
+                    self.procesar_devoluciones(eventos)
+                
             except zmq.Again:
                 # No hay mensajes disponibles, continuar
                 time.sleep(0.1)
@@ -6,7 +6,7 @@ Procesa solicitudes de préstamo usando REQ/REP con GC y GA
 """
 
 import zmq
-import json
+import orjson
 import time
 import os
 import logging
@@ -34,6 +34,8 @@ class ActorPrestamo:
         # Leer variables de entorno
         self.gc_host = os.getenv('GC_HOST', 'gc')
         self.gc_port = int(os.getenv('GC_ACTOR_PRESTAMO_PORT', '5004'))
+        # Endpoint ipc adicional para un GC en el mismo host (ACTOR_PRESTAMO_TRANSPORT=ipc)
+        self.ipc_path = os.getenv('ACTOR_PRESTAMO_IPC_PATH')
         self.ga_host = os.getenv('GA_HOST', 'ga')
         self.ga_port = int(os.getenv('GA_PORT', '5003'))
         
@@ -53,6 +55,11 @@ class ActorPrestamo:
             self.rep_socket.bind(bind_address)
             logger.info(f"Socket REP inicializado en {bind_address}")
             
+            if self.ipc_path:
+                ipc_address = f"ipc://{self.ipc_path}"
+                self.rep_socket.bind(ipc_address)
+                logger.info(f"Socket REP también escuchando en {ipc_address}")
+            
             # Pequeña pausa para asegurar que el socket esté listo
             time.sleep(1)
             
@@ -166,25 +173,26 @@ class ActorPrestamo:
                 "message": resultado_prestamo.get('message')
             }
     
-    def procesar_solicitud(self, mensaje_json):
+    def procesar_solicitud(self, mensaje):
         """
         Procesa una solicitud recibida de GC
         
         Args:
-            mensaje_json: JSON string con la solicitud
+            mensaje: Bytes JSON con la solicitud
         
         Returns:
-            JSON string con la respuesta
+            Bytes JSON (UTF-8) con la respuesta
         """
         try:
-            solicitud = json.loads(mensaje_json)
-            operacion = solicitud.get('operacion', '').upper()
+            solicitud = orjson.loads(mensaje)
+            # GC reenvía los bytes del PS sin reescribirlos: se acepta 'op' además de 'operacion'
+            operacion = (solicitud.get('operacion') or solicitud.get('op') or '').upper()
             
             if operacion != 'PRESTAMO':
-                return json.dumps({
+                return orjson.dumps({
                     "success": False,
                     "message": f"Operación inválida: {operacion}. Solo se permite PRESTAMO"
-                }, ensure_ascii=False)
+                })
             
             # Procesar préstamo
             resultado = self.procesar_prestamo(solicitud)
@@ -192,20 +200,20 @@ class ActorPrestamo:
             self.contador_prestamos += 1
             logger.info(f"Préstamo procesado #{self.contador_prestamos}: {resultado.get('success')}")
             
-            return json.dumps(resultado, ensure_ascii=False)
+            return orjson.dumps(resultado)
         
-        except json.JSONDecodeError as e:
+        except orjson.JSONDecodeError as e:
             logger.error(f"Error parseando JSON: {e}")
-            return json.dumps({
+            return orjson.dumps({
                 "success": False,
                 "message": "Formato JSON inválido"
-            }, ensure_ascii=False)
+            })
         except Exception as e:
             logger.error(f"Error procesando solicitud: {e}")
-            return json.dumps({
+            return orjson.dumps({
                 "success": False,
                 "message": f"Error interno: {str(e)}"
-            }, ensure_ascii=False)
+            })
     
     def manejar_solicitudes(self):
         """Maneja las solicitudes entrantes de GC"""
@@ -215,17 +223,18 @@ class ActorPrestamo:
             try:
                 # Recibir solicitud de GC
                 mensaje = self.rep_socket.recv(zmq.NOBLOCK)
-                mensaje_str = mensaje.decode('utf-8')
                 
-                logger.info(f"Solicitud recibida de GC: {mensaje_str}")
+                if logger.isEnabledFor(logging.INFO):
+                    logger.info("Solicitud recibida de GC: %s", mensaje.decode(errors='replace'))
                 
-                # Procesar solicitud
-                respuesta = self.procesar_solicitud(mensaje_str)
+                # Procesar solicitud directamente sobre los bytes recibidos
+                respuesta = self.procesar_solicitud(mensaje)
                 
-                # Enviar respuesta a GC
-                self.rep_socket.send(respuesta.encode('utf-8'))
+                # Enviar respuesta a GC (orjson ya entrega UTF-8)
+                self.rep_socket.send(respuesta)
                 
-                logger.info(f"Respuesta enviada a GC: {respuesta}")
+                if logger.isEnabledFor(logging.INFO):
+                    logger.info("Respuesta enviada a GC: %s", respuesta.decode())
                 
             except zmq.Again:
                 # No hay mensajes disponibles
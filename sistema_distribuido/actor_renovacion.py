@@ -62,17 +62,41 @@ class ActorRenovacion:
             logger.error(f"Error conectando al Gestor de Carga: {e}")
             raise
     
+    def _datos_renovacion(self, evento):
+        """Extrae del evento los datos de la operación RENEW_BOOK para GA"""
+        libro_id = evento.get('libro_id', '')
+        usuario_id = evento.get('usuario_id', '')
+        nueva_fecha = evento.get('nueva_fecha_devolucion', '')
+        sede = evento.get('sede', 'SEDE_1')
+        
+        logger.info(f"Procesando renovación: Libro {libro_id} - Usuario {usuario_id} - Sede {sede}")
+        logger.info(f"Nueva fecha de devolución: {nueva_fecha}")
+        
+        return {
+            "libro_id": libro_id,
+            "usuario_id": usuario_id,
+            "sede": sede,
+            "nueva_fecha": nueva_fecha
+        }
+    
+    def _registrar_resultado(self, resultado):
+        """Registra la respuesta de GA a una renovación; devuelve True si fue exitosa"""
+        if not resultado:
+            logger.error("Error comunicándose con GA para procesar renovación")
+            return False
+        
+        if resultado.get('success'):
+            self.contador_renovaciones += 1
+            logger.info(f"Renovación procesada exitosamente (#{self.contador_renovaciones}): {resultado.get('message')}")
+            return True
+        else:
+            logger.warning(f"Error en renovación: {resultado.get('message')}")
+            return False
+    
     def procesar_renovacion(self, evento):
         """Procesa un evento de renovación usando GA"""
         try:
-            libro_id = evento.get('libro_id', '')
-            usuario_id = evento.get('usuario_id', '')
-            nueva_fecha = evento.get('nueva_fecha_devolucion', '')
-            sede = evento.get('sede', 'SEDE_1')
-            timestamp = evento.get('timestamp', '')
-            
-            logger.info(f"Procesando renovación: Libro {libro_id} - Usuario {usuario_id} - Sede {sede}")
-            logger.info(f"Nueva fecha de devolución: {nueva_fecha}")
+            datos = self._datos_renovacion(evento)
             
             # Verificar conexión con GA
             health = self.failover_manager.verificar_y_reconectar()
@@ -81,32 +105,34 @@ class ActorRenovacion:
                 return False
             
             # Enviar operación de renovación a GA
-            resultado = self.failover_manager.enviar_operacion(
-                "RENEW_BOOK",
-                {
-                    "libro_id": libro_id,
-                    "usuario_id": usuario_id,
-                    "sede": sede,
-                    "nueva_fecha": nueva_fecha
-                }
-            )
-            
-            if not resultado:
-                logger.error("Error comunicándose con GA para procesar renovación")
-                return False
-            
-            if resultado.get('success'):
-                self.contador_renovaciones += 1
-                logger.info(f"Renovación procesada exitosamente (#{self.contador_renovaciones}): {resultado.get('message')}")
-                return True
-            else:
-                logger.warning(f"Error en renovación: {resultado.get('message')}")
-                return False
+            resultado = self.failover_manager.enviar_operacion("RENEW_BOOK", datos)
+            return self._registrar_resultado(resultado)
             
         except Exception as e:
             logger.error(f"Error procesando renovación: {e}")
             return False
     
+    def procesar_renovaciones(self, eventos):
+        """Procesa los eventos de un mismo mensaje enviándolos a GA como un lote en pipelining"""
+        if len(eventos) == 1:
+            self.procesar_renovacion(eventos[0])
+            return
+        
+        try:
+            operaciones = [("RENEW_BOOK", self._datos_renovacion(evento)) for evento in eventos]
+            
+            # Verificar conexión con GA una vez para todo el lote
+            health = self.failover_manager.verificar_y_reconectar()
+            if not health.get('ok'):
+                logger.error(f"GA no está disponible para procesar {len(eventos)} renovaciones")
+                return
+            
+            for resultado in self.failover_manager.enviar_lote(operaciones):
+                self._registrar_resultado(resultado)
+            
+        except Exception as e:
+            logger.error(f"Error procesando lote de renovaciones: {e}")
+    
     def escuchar_eventos(self):
         """Escucha eventos de renovación del Gestor de Carga"""
         logger.info("Iniciando escucha de eventos de renovación...")
@@ -116,22 +142,32 @@ class ActorRenovacion:
                 # Recibir mensaje (topic + datos)
                 mensaje = self.sub_socket.recv_multipart(zmq.NOBLOCK)
                 
-                if len(mensaje) >= 2:
-                    topic = mensaje[0].decode('utf-8')
-                    datos_json = mensaje[1].decode('utf-8')
+                # Con GC_PUB_BATCH=1 el GC agrupa varios eventos: [topic, evento1, evento2, ...]
+                topic = mensaje[0].decode('utf-8')
+                eventos = []
+                for datos_bytes in mensaje[1:]:
+                    datos_json = datos_bytes.decode('utf-8')
                     
                     logger.info(f"Evento recibido - Topic: {topic}")
                     logger.info(f"Datos: {datos_json}")
                     
                     # Parsear evento
-                    evento = json.loads(datos_json)
+                    try:
+                        evento = json.loads(datos_json)
+                    except json.JSONDecodeError as e:
+                        logger.error(f"Error parseando evento JSON: {e}")
+                        continue
                     
                     # Procesar solo eventos de renovación
                     if topic == "renovacion" and evento.get('operacion') == 'RENOVACION':
-                        self.procesar_renovacion(evento)
+                        eventos.append(evento)
                     else:
                         logger.warning(f"Evento inesperado recibido: {topic} - {evento.get('operacion', 'N/A')}")
                 
+                # Los eventos de un mismo mensaje van a GA en un solo lote
+                if eventos:
+                    self.procesar_renovaciones(eventos)
+                
             except zmq.Again:
                 # No hay mensajes disponibles, continuar
                 time.sleep(0.1)
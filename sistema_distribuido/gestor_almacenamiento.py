@@ -7,29 +7,57 @@ Proporciona operaciones de base de datos vía ZeroMQ REQ/REP
 """
 
 import zmq
-import json
+import orjson
 import os
+import sys
 import threading
 import time
 import shutil
-from datetime import datetime, timedelta
+from collections import OrderedDict
+from datetime import date, datetime, timedelta
 import logging
 from filelock import FileLock
+from utils_logging import configurar_logging
 
-# Configurar logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - GA - %(levelname)s - %(message)s',
-    datefmt='%Y-%m-%d %H:%M:%S'
-)
 logger = logging.getLogger(__name__)
 
+# Máximo de entradas en la caché de resultados de get_book
+GET_BOOK_CACHE_MAX = 1024
+
+# fdatasync evita vaciar metadatos no esenciales (mtime) en cada registro del WAL;
+# no existe en todas las plataformas (p. ej. macOS), donde se usa fsync
+_sincronizar_wal = getattr(os, 'fdatasync', os.fsync)
+
+def _sincronizar_directorio(archivo):
+    """Persiste la entrada de directorio de archivo para que un rename o una creación sobrevivan a una caída"""
+    if not hasattr(os, 'O_DIRECTORY'):
+        return
+    dir_fd = os.open(os.path.dirname(archivo) or '.', os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        os.fsync(dir_fd)
+    finally:
+        os.close(dir_fd)
+
+# Contador de metadata correspondiente a cada sede
+SEDE_TO_KEY = {
+    'SEDE_1': 'ejemplares_prestados_sede_1',
+    'SEDE_2': 'ejemplares_prestados_sede_2'
+}
+
+def _libro_id(solicitud):
+    """Extrae el libro_id de una solicitud, internado para acelerar los lookups en los índices"""
+    libro_id = solicitud.get('libro_id')
+    return sys.intern(libro_id) if isinstance(libro_id, str) else libro_id
+
 class GestorAlmacenamiento:
     def __init__(self, 
                  primary_path="data/primary/libros.json",
                  secondary_path="data/secondary/libros.json",
                  port=5003,
-                 host="0.0.0.0"):
+                 host="0.0.0.0",
+                 snapshot_ops=100,
+                 snapshot_interval=5,
+                 json_indent=False):
         """
         Inicializa el Gestor de Almacenamiento
         
@@ -38,6 +66,9 @@ class GestorAlmacenamiento:
             secondary_path: Ruta al archivo de réplica secundaria
             port: Puerto para el socket REP
             host: Host para el socket REP
+            snapshot_ops: Operaciones en el WAL tras las cuales se escribe un snapshot JSON
+            snapshot_interval: Segundos entre snapshots periódicos (si hay operaciones pendientes)
+            json_indent: Si True, los archivos JSON se escriben indentados (solo para depuración)
         """
         self.context = zmq.Context()
         self.rep_socket = None
@@ -49,12 +80,47 @@ class GestorAlmacenamiento:
         self.contador_operaciones = 0
         self.replicacion_lock = threading.Lock()
         
+        # Estado en memoria: snapshot de la primaria + registros del WAL aplicados.
+        # En cada snapshot el WAL activo se rota a f"{wal_path}.{seq}" (seq = último registro)
+        self.wal_path = f"{self.primary_path}.wal"
+        self.wal = None
+        self.wal_seq = 0
+        self.snapshot_seq = 0  # wal_seq del snapshot que hay en disco en la primaria
+        self.ops_desde_snapshot = 0
+        self.snapshot_ops = snapshot_ops
+        self.snapshot_interval = snapshot_interval
+        self.json_opts = orjson.OPT_INDENT_2 if json_indent else 0
+        self.estado_lock = threading.Lock()
+        self.snapshot_lock = threading.Lock()  # Serializa escrituras de snapshot concurrentes
+        self.snapshot_thread = None
+        # Señal al thread de snapshots: se alcanzó snapshot_ops o el GA se detiene
+        self.snapshot_evento = threading.Event()
+        self.base_datos = None
+        self.libros_por_id = {}
+        self.ejemplares_por_id = {}
+        
+        # Caché LRU de get_book: (libro_id, criterios) -> libro; se vacía en cada mutación
+        self._get_book_cache = OrderedDict()
+        
+        # Tabla de despacho: operación -> handler (un solo lookup por solicitud)
+        self._ops = {
+            'GET_BOOK': self._op_get_book,
+            'LOAN_BOOK': self._op_loan_book,
+            'RETURN_BOOK': self._op_return_book,
+            'RENEW_BOOK': self._op_renew_book,
+            'UPDATE_COPIES': self._op_update_copies,
+            'HEALTH_CHECK': self._op_health_check
+        }
+        
         # Asegurar que los directorios existen
         os.makedirs(os.path.dirname(self.primary_path), exist_ok=True)
         os.makedirs(os.path.dirname(self.secondary_path), exist_ok=True)
         
         # Inicializar réplicas si no existen
         self._inicializar_replicas()
+        
+        # Cargar el último snapshot y reproducir el WAL encima
+        self._cargar_estado()
     
     def _inicializar_replicas(self):
         """Inicializa las réplicas si no existen o están vacías"""
@@ -99,8 +165,8 @@ class GestorAlmacenamiento:
             "libros": [],
             "ejemplares": []
         }
-        with open(archivo, 'w', encoding='utf-8') as f:
-            json.dump(estructura_vacia, f, ensure_ascii=False, indent=2)
+        with open(archivo, 'wb') as f:
+            f.write(orjson.dumps(estructura_vacia, option=self.json_opts))
     
     def _cargar_base_datos(self, archivo):
         """Carga la base de datos desde un archivo"""
@@ -111,19 +177,23 @@ class GestorAlmacenamiento:
                     logger.error(f"Archivo no encontrado: {archivo}")
                     return None
                 
-                with open(archivo, 'r', encoding='utf-8') as f:
-                    base_datos = json.load(f)
+                with open(archivo, 'rb') as f:
+                    base_datos = orjson.loads(f.read())
                 
                 return base_datos
-        except json.JSONDecodeError as e:
+        except orjson.JSONDecodeError as e:
             logger.error(f"Error parseando JSON desde {archivo}: {e}")
             return None
         except Exception as e:
             logger.error(f"Error cargando base de datos desde {archivo}: {e}")
             return None
     
-    def _guardar_base_datos(self, base_datos, archivo):
-        """Guarda la base de datos en un archivo"""
+    def _guardar_base_datos(self, datos, archivo):
+        """Guarda la base de datos ya serializada (bytes JSON) en un archivo
+        
+        Se escribe en un temporal con fsync y se renombra con os.replace: una caída
+        a mitad de escritura deja intacta la versión anterior del archivo.
+        """
         try:
             lock = FileLock(f"{archivo}.lock")
             with lock:
@@ -132,26 +202,30 @@ class GestorAlmacenamiento:
                     backup_file = f"{archivo}.backup"
                     shutil.copy2(archivo, backup_file)
                 
-                # Guardar datos
-                with open(archivo, 'w', encoding='utf-8') as f:
-                    json.dump(base_datos, f, ensure_ascii=False, indent=2)
+                # Guardar datos en un temporal y reemplazar el archivo de forma atómica
+                temporal = f"{archivo}.tmp"
+                with open(temporal, 'wb') as f:
+                    f.write(datos)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(temporal, archivo)
+                _sincronizar_directorio(archivo)
                 
                 return True
         except Exception as e:
             logger.error(f"Error guardando base de datos en {archivo}: {e}")
             return False
     
-    def _replicar_a_secundaria(self, base_datos):
-        """Replica los datos a la réplica secundaria de forma asíncrona"""
+    def _replicar_a_secundaria(self):
+        """Replica el último snapshot de la primaria a la secundaria de forma asíncrona"""
         def replicar():
             try:
                 time.sleep(0.1)  # Pequeña pausa para no bloquear
                 with self.replicacion_lock:
                     logger.info("Iniciando replicación a secundaria...")
-                    if self._guardar_base_datos(base_datos, self.secondary_path):
-                        logger.info("Réplica secundaria actualizada exitosamente")
-                    else:
-                        logger.error("Error actualizando réplica secundaria")
+                    with FileLock(f"{self.primary_path}.lock"), FileLock(f"{self.secondary_path}.lock"):
+                        shutil.copy2(self.primary_path, self.secondary_path)
+                    logger.info("Réplica secundaria actualizada exitosamente")
             except Exception as e:
                 logger.error(f"Error en replicación asíncrona: {e}")
         
@@ -159,10 +233,238 @@ class GestorAlmacenamiento:
         thread = threading.Thread(target=replicar, daemon=True)
         thread.start()
     
+    def _segmentos_wal(self):
+        """Segmentos rotados del WAL como (último seq, ruta), ordenados por seq"""
+        directorio = os.path.dirname(self.wal_path) or '.'
+        prefijo = os.path.basename(self.wal_path) + '.'
+        segmentos = []
+        for nombre in os.listdir(directorio):
+            sufijo = nombre[len(prefijo):]
+            if nombre.startswith(prefijo) and sufijo.isdigit():
+                segmentos.append((int(sufijo), os.path.join(directorio, nombre)))
+        segmentos.sort()
+        return segmentos
+    
+    def _leer_registros(self, ruta):
+        """Lee los registros completos de un archivo del WAL
+        
+        Returns:
+            (registros, bytes válidos): una última línea incompleta (caída a mitad
+            de escritura) se descarta y no cuenta en los bytes válidos
+        """
+        registros = []
+        validos = 0
+        with open(ruta, 'rb') as f:
+            for linea in f:
+                try:
+                    # Sin '\n' final la escritura no terminó, aunque el JSON sea válido
+                    registro = orjson.loads(linea) if linea.endswith(b'\n') else None
+                except orjson.JSONDecodeError:
+                    registro = None
+                if registro is None:
+                    logger.warning(f"Registro incompleto al final de {ruta}, se descarta")
+                    break
+                registros.append(registro)
+                validos += len(linea)
+        return registros, validos
+    
+    def _leer_wal(self):
+        """Lee los segmentos rotados y el WAL activo, en orden de seq
+        
+        Un registro incompleto al final del WAL activo se recorta del archivo para
+        que los registros nuevos no queden escritos detrás de él.
+        """
+        registros = []
+        for _, segmento in self._segmentos_wal():
+            registros.extend(self._leer_registros(segmento)[0])
+        if os.path.exists(self.wal_path):
+            activos, validos = self._leer_registros(self.wal_path)
+            if validos < os.path.getsize(self.wal_path):
+                os.truncate(self.wal_path, validos)
+            registros.extend(activos)
+        return registros
+    
+    def _cargar_estado(self):
+        """Carga el snapshot más reciente que enlace con el WAL y reproduce los registros pendientes
+        
+        Los candidatos son la primaria, su .backup y la secundaria; se prueban de
+        mayor a menor wal_seq. Un snapshot solo se acepta si los registros del WAL
+        que le siguen empiezan en wal_seq + 1 y son contiguos: de lo contrario se
+        perderían operaciones y los contadores quedarían descuadrados.
+        """
+        registros = self._leer_wal()
+        
+        candidatos = []
+        for archivo in (self.primary_path, f"{self.primary_path}.backup", self.secondary_path):
+            if os.path.exists(archivo):
+                base_datos = self._cargar_base_datos(archivo)
+                if base_datos:
+                    candidatos.append((archivo, base_datos))
+        # sort es estable: a igual wal_seq se respeta el orden primaria, backup, secundaria
+        candidatos.sort(key=lambda c: c[1].get('metadata', {}).get('wal_seq', 0), reverse=True)
+        
+        for archivo_cargado, base_datos in candidatos:
+            snapshot_seq = base_datos.get('metadata', {}).get('wal_seq', 0)
+            pendientes = [r for r in registros if r['seq'] > snapshot_seq]
+            if all(r['seq'] == snapshot_seq + i for i, r in enumerate(pendientes, 1)):
+                break
+            logger.error(f"{archivo_cargado} (wal_seq={snapshot_seq}) no enlaza con el WAL "
+                         f"(siguiente registro: {pendientes[0]['seq']}); se descarta")
+        else:
+            raise RuntimeError(f"Ninguna réplica enlaza con el WAL: {self.primary_path}")
+        
+        if archivo_cargado != self.primary_path:
+            logger.warning(f"Réplica primaria ilegible o desfasada; estado cargado desde {archivo_cargado}")
+        
+        self.base_datos = base_datos
+        # IDs internados: los lookups con IDs también internados comparan por identidad
+        for libro in base_datos.get('libros', []):
+            libro['libro_id'] = sys.intern(libro['libro_id'])
+        self.libros_por_id = {libro['libro_id']: libro for libro in base_datos.get('libros', [])}
+        
+        # Cada ejemplar aparece dos veces (dentro de su libro y en el array global):
+        # se indexan ambas copias para actualizarlas sin recorrer listas
+        self.ejemplares_por_id = {}
+        for libro in base_datos.get('libros', []):
+            for ejemplar in libro.get('ejemplares', []):
+                self.ejemplares_por_id.setdefault(ejemplar['ejemplar_id'], []).append(ejemplar)
+        for ejemplar in base_datos.get('ejemplares', []):
+            self.ejemplares_por_id.setdefault(ejemplar['ejemplar_id'], []).append(ejemplar)
+        self.snapshot_seq = snapshot_seq
+        self.wal_seq = snapshot_seq
+        
+        # Reproducir registros del WAL posteriores al snapshot
+        for registro in pendientes:
+            self._aplicar_registro(registro)
+            self.wal_seq = registro['seq']
+        
+        self.ops_desde_snapshot = len(pendientes)
+        self.wal = open(self.wal_path, 'ab', buffering=0)
+        logger.info(f"Estado cargado desde {archivo_cargado} ({len(pendientes)} registros del WAL reproducidos)")
+    
+    def _aplicar_registro(self, registro):
+        """Aplica un registro del WAL sobre el estado en memoria"""
+        op = registro['op']
+        libro = self.libros_por_id[registro['libro_id']]
+        metadata = self.base_datos['metadata']
+        
+        if op == 'LOAN_BOOK':
+            campos = {
+                'estado': 'prestado',
+                'usuario_prestamo': registro['usuario_id'],
+                'sede': registro['sede'],
+                'fecha_devolucion': registro['fecha_devolucion']
+            }
+            libro['ejemplares_disponibles'] -= 1
+            libro['ejemplares_prestados'] += 1
+            metadata['ejemplares_disponibles'] -= 1
+            metadata[SEDE_TO_KEY[registro['sede']]] += 1
+        elif op == 'RETURN_BOOK':
+            campos = {
+                'estado': 'disponible',
+                'usuario_prestamo': None,
+                'sede': None,
+                'fecha_devolucion': None
+            }
+            libro['ejemplares_disponibles'] += 1
+            libro['ejemplares_prestados'] -= 1
+            metadata['ejemplares_disponibles'] += 1
+            metadata[SEDE_TO_KEY[registro['sede']]] -= 1
+        elif op == 'RENEW_BOOK':
+            campos = {'fecha_devolucion': registro['nueva_fecha']}
+        else:
+            raise ValueError(f"Registro de WAL desconocido: {op}")
+        
+        # Actualizar el ejemplar dentro del libro y en el array global
+        for ejemplar in self.ejemplares_por_id.get(registro['ejemplar_id'], ()):
+            ejemplar.update(campos)
+    
+    def _registrar_mutacion(self, registro):
+        """
+        Escribe el registro en el WAL (con fsync) y luego lo aplica en memoria
+        
+        Returns:
+            True si el registro quedó persistido y aplicado
+        """
+        with self.estado_lock:
+            registro['seq'] = self.wal_seq + 1
+            registro['ts'] = time.time()
+            try:
+                self.wal.write(orjson.dumps(registro) + b'\n')
+                _sincronizar_wal(self.wal.fileno())
+            except OSError as e:
+                logger.error(f"Error escribiendo en WAL {self.wal_path}: {e}")
+                return False
+            
+            self.wal_seq = registro['seq']
+            self._aplicar_registro(registro)
+            self._get_book_cache.clear()
+            self.ops_desde_snapshot += 1
+            
+            if self.ops_desde_snapshot >= self.snapshot_ops:
+                # El snapshot lo escribe el thread de snapshots, fuera del camino de la solicitud
+                self.snapshot_evento.set()
+        return True
+    
+    def _guardar_snapshot(self):
+        """Escribe el estado completo en la primaria y replica a la secundaria
+        
+        Bajo estado_lock solo se serializa el estado y se rota el WAL activo; la
+        escritura del snapshot (backup, temporal, fsync, replace) ocurre fuera del
+        lock para no detener las mutaciones. Los segmentos rotados se borran cuando
+        ya no los necesita el snapshot más antiguo que se conserva (.backup).
+        """
+        with self.snapshot_lock:
+            with self.estado_lock:
+                seq = self.wal_seq
+                self.base_datos['metadata']['wal_seq'] = seq
+                datos = orjson.dumps(self.base_datos, option=self.json_opts)
+                rotadas = self.ops_desde_snapshot
+                if rotadas:
+                    self.wal.close()
+                    try:
+                        os.replace(self.wal_path, f"{self.wal_path}.{seq}")
+                    finally:
+                        self.wal = open(self.wal_path, 'ab', buffering=0)
+                    _sincronizar_directorio(self.wal_path)
+                    self.ops_desde_snapshot = 0
+            
+            if not self._guardar_base_datos(datos, self.primary_path):
+                # Los segmentos del WAL se conservan: el estado sigue siendo recuperable
+                with self.estado_lock:
+                    self.ops_desde_snapshot += rotadas
+                return False
+            
+            # La .backup quedó con el snapshot anterior: sobran los segmentos que este ya incluye
+            for seq_fin, segmento in self._segmentos_wal():
+                if seq_fin <= self.snapshot_seq:
+                    os.remove(segmento)
+            self.snapshot_seq = seq
+        
+        self._replicar_a_secundaria()
+        return True
+    
+    def _snapshot_loop(self):
+        """Loop que escribe snapshots periódicos si hay operaciones pendientes en el WAL"""
+        while self.running:
+            # Despierta al cumplirse el intervalo, al alcanzar snapshot_ops o al detener el GA
+            self.snapshot_evento.wait(self.snapshot_interval)
+            self.snapshot_evento.clear()
+            if not self.running:
+                break
+            try:
+                if self.ops_desde_snapshot > 0:
+                    self._guardar_snapshot()
+            except Exception as e:
+                logger.error(f"Error escribiendo snapshot: {e}")
+    
     def get_book(self, libro_id, search_criteria=None):
         """
         Busca un libro por ID o criterios de búsqueda
         
+        Los resultados se memorizan en una caché LRU hasta la siguiente
+        mutación del estado.
+        
         Args:
             libro_id: ID del libro (puede ser None si se usa search_criteria)
             search_criteria: Dict con criterios de búsqueda (titulo, autor, etc.)
@@ -170,21 +472,35 @@ class GestorAlmacenamiento:
         Returns:
             Dict con el libro encontrado o None
         """
-        base_datos = self._cargar_base_datos(self.primary_path)
-        if not base_datos:
-            return None
+        try:
+            clave = (libro_id, frozenset(search_criteria.items()) if search_criteria else None)
+        except (AttributeError, TypeError):
+            clave = None  # Criterios no hashables: no se memoriza
         
-        libros = base_datos.get('libros', [])
+        if clave is not None and clave in self._get_book_cache:
+            self._get_book_cache.move_to_end(clave)
+            return self._get_book_cache[clave]
         
+        libro = self._buscar_libro(libro_id, search_criteria)
+        
+        if clave is not None:
+            self._get_book_cache[clave] = libro
+            if len(self._get_book_cache) > GET_BOOK_CACHE_MAX:
+                self._get_book_cache.popitem(last=False)
+        
+        return libro
+    
+    def _buscar_libro(self, libro_id, search_criteria):
+        """Busca un libro en memoria por ID o, si no aparece, por criterios"""
         # Búsqueda por ID
         if libro_id:
-            for libro in libros:
-                if libro.get('libro_id') == libro_id:
-                    return libro
+            libro = self.libros_por_id.get(libro_id)
+            if libro:
+                return libro
         
         # Búsqueda por criterios
         if search_criteria:
-            for libro in libros:
+            for libro in self.base_datos.get('libros', []):
                 match = True
                 if 'titulo' in search_criteria:
                     if search_criteria['titulo'].lower() not in libro.get('titulo', '').lower():
@@ -206,19 +522,8 @@ class GestorAlmacenamiento:
         Returns:
             Dict con resultado: {"success": bool, "message": str, "ejemplar_id": str}
         """
-        base_datos = self._cargar_base_datos(self.primary_path)
-        if not base_datos:
-            return {"success": False, "message": "Error cargando base de datos"}
-        
-        libros = base_datos.get('libros', [])
-        ejemplares = base_datos.get('ejemplares', [])
-        
         # Buscar el libro
-        libro_encontrado = None
-        for libro in libros:
-            if libro.get('libro_id') == libro_id:
-                libro_encontrado = libro
-                break
+        libro_encontrado = self.libros_por_id.get(libro_id)
         
         if not libro_encontrado:
             return {"success": False, "message": f"Libro {libro_id} no encontrado"}
@@ -238,50 +543,42 @@ class GestorAlmacenamiento:
             return {"success": False, "message": f"No se encontró ejemplar disponible del libro {libro_id}"}
         
         # Calcular fecha de devolución (máximo 2 semanas)
-        fecha_devolucion = (datetime.now() + timedelta(days=14)).strftime('%Y-%m-%d')
-        
-        # Actualizar ejemplar
-        ejemplar_prestado['estado'] = 'prestado'
-        ejemplar_prestado['usuario_prestamo'] = usuario_id
-        ejemplar_prestado['sede'] = sede
-        ejemplar_prestado['fecha_devolucion'] = fecha_devolucion
-        
-        # Actualizar contadores del libro
-        libro_encontrado['ejemplares_disponibles'] -= 1
-        libro_encontrado['ejemplares_prestados'] += 1
-        
-        # Actualizar contadores globales
-        base_datos['metadata']['ejemplares_disponibles'] -= 1
-        if sede == 'SEDE_1':
-            base_datos['metadata']['ejemplares_prestados_sede_1'] += 1
-        else:
-            base_datos['metadata']['ejemplares_prestados_sede_2'] += 1
-        
-        # Actualizar también en el array global de ejemplares
-        for ejemplar in ejemplares:
-            if ejemplar.get('ejemplar_id') == ejemplar_prestado['ejemplar_id']:
-                ejemplar['estado'] = 'prestado'
-                ejemplar['usuario_prestamo'] = usuario_id
-                ejemplar['sede'] = sede
-                ejemplar['fecha_devolucion'] = fecha_devolucion
-                break
-        
-        # Guardar en primaria
-        if not self._guardar_base_datos(base_datos, self.primary_path):
+        fecha_devolucion = (date.today() + timedelta(days=14)).isoformat()
+        ejemplar_id = ejemplar_prestado['ejemplar_id']
+        
+        # Persistir en el WAL y aplicar en memoria
+        registro = {
+            "op": "LOAN_BOOK",
+            "libro_id": libro_id,
+            "ejemplar_id": ejemplar_id,
+            "usuario_id": usuario_id,
+            "sede": sede,
+            "fecha_devolucion": fecha_devolucion
+        }
+        if not self._registrar_mutacion(registro):
             return {"success": False, "message": "Error guardando en réplica primaria"}
         
-        # Replicar a secundaria (asíncrono)
-        self._replicar_a_secundaria(base_datos)
-        
-        logger.info(f"Préstamo realizado: Libro {libro_id}, Ejemplar {ejemplar_prestado['ejemplar_id']}, Usuario {usuario_id}, Sede {sede}")
+        logger.info("Préstamo realizado: Libro %s, Ejemplar %s, Usuario %s, Sede %s", libro_id, ejemplar_id, usuario_id, sede)
         
         return {
             "success": True,
             "message": f"Préstamo realizado exitosamente",
-            "ejemplar_id": ejemplar_prestado['ejemplar_id'],
+            "ejemplar_id": ejemplar_id,
             "fecha_devolucion": fecha_devolucion
         }
     
+    def _buscar_ejemplar_prestado(self, libro_id, usuario_id, sede):
+        """Busca el ejemplar de un libro prestado a un usuario en una sede"""
+        libro = self.libros_por_id.get(libro_id)
+        if not libro:
+            return None
+        for ejemplar in libro.get('ejemplares', []):
+            if (ejemplar.get('estado') == 'prestado' and
+                ejemplar.get('usuario_prestamo') == usuario_id and
+                ejemplar.get('sede') == sede):
+                return ejemplar
+        return None
+    
     def return_book(self, libro_id, usuario_id, sede):
         """
         Devuelve un libro prestado
@@ -294,68 +591,24 @@ class GestorAlmacenamiento:
         Returns:
             Dict con resultado: {"success": bool, "message": str}
         """
-        base_datos = self._cargar_base_datos(self.primary_path)
-        if not base_datos:
-            return {"success": False, "message": "Error cargando base de datos"}
-        
-        libros = base_datos.get('libros', [])
-        ejemplares = base_datos.get('ejemplares', [])
-        
         # Buscar el libro y ejemplar prestado
-        ejemplar_devuelto = False
-        for libro in libros:
-            if libro.get('libro_id') == libro_id:
-                for ejemplar in libro.get('ejemplares', []):
-                    if (ejemplar.get('estado') == 'prestado' and
-                        ejemplar.get('usuario_prestamo') == usuario_id and
-                        ejemplar.get('sede') == sede):
-                        
-                        # Marcar como disponible
-                        ejemplar['estado'] = 'disponible'
-                        ejemplar['usuario_prestamo'] = None
-                        ejemplar['sede'] = None
-                        ejemplar['fecha_devolucion'] = None
-                        
-                        # Actualizar contadores
-                        libro['ejemplares_disponibles'] += 1
-                        libro['ejemplares_prestados'] -= 1
-                        
-                        ejemplar_devuelto = True
-                        break
-                
-                if ejemplar_devuelto:
-                    break
+        ejemplar = self._buscar_ejemplar_prestado(libro_id, usuario_id, sede)
         
-        if not ejemplar_devuelto:
+        if not ejemplar:
             return {"success": False, "message": f"No se encontró ejemplar prestado del libro {libro_id} por usuario {usuario_id} en sede {sede}"}
         
-        # Actualizar contadores globales
-        base_datos['metadata']['ejemplares_disponibles'] += 1
-        if sede == 'SEDE_1':
-            base_datos['metadata']['ejemplares_prestados_sede_1'] -= 1
-        else:
-            base_datos['metadata']['ejemplares_prestados_sede_2'] -= 1
-        
-        # Actualizar en array global
-        for ejemplar in ejemplares:
-            if (ejemplar.get('libro_id') == libro_id and
-                ejemplar.get('usuario_prestamo') == usuario_id and
-                ejemplar.get('sede') == sede and
-                ejemplar.get('estado') == 'prestado'):
-                ejemplar['estado'] = 'disponible'
-                ejemplar['usuario_prestamo'] = None
-                ejemplar['sede'] = None
-                ejemplar['fecha_devolucion'] = None
-                break
-        
-        # Guardar en primaria
-        if not self._guardar_base_datos(base_datos, self.primary_path):
+        # Persistir en el WAL y aplicar en memoria
+        registro = {
+            "op": "RETURN_BOOK",
+            "libro_id": libro_id,
+            "ejemplar_id": ejemplar['ejemplar_id'],
+            "usuario_id": usuario_id,
+            "sede": sede
+        }
+        if not self._registrar_mutacion(registro):
             return {"success": False, "message": "Error guardando en réplica primaria"}
         
-        # Replicar a secundaria (asíncrono)
-        self._replicar_a_secundaria(base_datos)
-        
-        logger.info(f"Devolución realizada: Libro {libro_id}, Usuario {usuario_id}, Sede {sede}")
+        logger.info("Devolución realizada: Libro %s, Usuario %s, Sede %s", libro_id, usuario_id, sede)
         
         return {"success": True, "message": "Devolución realizada exitosamente"}
     
@@ -372,49 +625,25 @@ class GestorAlmacenamiento:
         Returns:
             Dict con resultado: {"success": bool, "message": str}
         """
-        base_datos = self._cargar_base_datos(self.primary_path)
-        if not base_datos:
-            return {"success": False, "message": "Error cargando base de datos"}
-        
-        libros = base_datos.get('libros', [])
-        ejemplares = base_datos.get('ejemplares', [])
-        
-        # Buscar y actualizar ejemplar
-        ejemplar_renovado = False
-        for libro in libros:
-            if libro.get('libro_id') == libro_id:
-                for ejemplar in libro.get('ejemplares', []):
-                    if (ejemplar.get('estado') == 'prestado' and
-                        ejemplar.get('usuario_prestamo') == usuario_id and
-                        ejemplar.get('sede') == sede):
-                        
-                        ejemplar['fecha_devolucion'] = nueva_fecha
-                        ejemplar_renovado = True
-                        break
-                
-                if ejemplar_renovado:
-                    break
+        # Buscar el ejemplar prestado
+        ejemplar = self._buscar_ejemplar_prestado(libro_id, usuario_id, sede)
         
-        if not ejemplar_renovado:
+        if not ejemplar:
             return {"success": False, "message": f"No se encontró ejemplar prestado del libro {libro_id} por usuario {usuario_id} en sede {sede}"}
         
-        # Actualizar en array global
-        for ejemplar in ejemplares:
-            if (ejemplar.get('libro_id') == libro_id and
-                ejemplar.get('usuario_prestamo') == usuario_id and
-                ejemplar.get('sede') == sede and
-                ejemplar.get('estado') == 'prestado'):
-                ejemplar['fecha_devolucion'] = nueva_fecha
-                break
-        
-        # Guardar en primaria
-        if not self._guardar_base_datos(base_datos, self.primary_path):
+        # Persistir en el WAL y aplicar en memoria
+        registro = {
+            "op": "RENEW_BOOK",
+            "libro_id": libro_id,
+            "ejemplar_id": ejemplar['ejemplar_id'],
+            "usuario_id": usuario_id,
+            "sede": sede,
+            "nueva_fecha": nueva_fecha
+        }
+        if not self._registrar_mutacion(registro):
             return {"success": False, "message": "Error guardando en réplica primaria"}
         
-        # Replicar a secundaria (asíncrono)
-        self._replicar_a_secundaria(base_datos)
-        
-        logger.info(f"Renovación realizada: Libro {libro_id}, Usuario {usuario_id}, Sede {sede}, Nueva fecha: {nueva_fecha}")
+        logger.info("Renovación realizada: Libro %s, Usuario %s, Sede %s, Nueva fecha: %s", libro_id, usuario_id, sede, nueva_fecha)
         
         return {"success": True, "message": "Renovación realizada exitosamente"}
     
@@ -429,17 +658,11 @@ class GestorAlmacenamiento:
         Returns:
             Dict con resultado: {"success": bool, "message": str}
         """
-        base_datos = self._cargar_base_datos(self.primary_path)
-        if not base_datos:
-            return {"success": False, "message": "Error cargando base de datos"}
-        
         # Implementar lógica de actualización según cambios
-        # Por ahora, solo guardamos
-        if not self._guardar_base_datos(base_datos, self.primary_path):
+        # Por ahora, solo forzamos un snapshot del estado actual
+        if not self._guardar_snapshot():
             return {"success": False, "message": "Error guardando en réplica primaria"}
         
-        self._replicar_a_secundaria(base_datos)
-        
         return {"success": True, "message": "Actualización realizada exitosamente"}
     
     def health_check(self):
@@ -462,73 +685,76 @@ class GestorAlmacenamiento:
             "secondary_path": self.secondary_path
         }
     
-    def procesar_solicitud(self, mensaje_json):
+    def _op_get_book(self, solicitud):
+        """Handler de GET_BOOK"""
+        libro = self.get_book(_libro_id(solicitud), solicitud.get('search_criteria'))
+        if libro:
+            return orjson.dumps({"success": True, "libro": libro})
+        return orjson.dumps({"success": False, "message": "Libro no encontrado"})
+    
+    def _op_loan_book(self, solicitud):
+        """Handler de LOAN_BOOK"""
+        sede = solicitud.get('sede', 'SEDE_1')
+        if sede not in SEDE_TO_KEY:
+            return orjson.dumps({"success": False, "message": f"Sede inválida: {sede}"})
+        resultado = self.loan_book(_libro_id(solicitud), solicitud.get('usuario_id'), sede)
+        return orjson.dumps(resultado)
+    
+    def _op_return_book(self, solicitud):
+        """Handler de RETURN_BOOK"""
+        sede = solicitud.get('sede', 'SEDE_1')
+        if sede not in SEDE_TO_KEY:
+            return orjson.dumps({"success": False, "message": f"Sede inválida: {sede}"})
+        resultado = self.return_book(_libro_id(solicitud), solicitud.get('usuario_id'), sede)
+        return orjson.dumps(resultado)
+    
+    def _op_renew_book(self, solicitud):
+        """Handler de RENEW_BOOK"""
+        resultado = self.renew_book(
+            _libro_id(solicitud),
+            solicitud.get('usuario_id'),
+            solicitud.get('sede', 'SEDE_1'),
+            solicitud.get('nueva_fecha')
+        )
+        return orjson.dumps(resultado)
+    
+    def _op_update_copies(self, solicitud):
+        """Handler de UPDATE_COPIES"""
+        resultado = self.update_copies(_libro_id(solicitud), solicitud.get('cambios', {}))
+        return orjson.dumps(resultado)
+    
+    def _op_health_check(self, solicitud):
+        """Handler de HEALTH_CHECK"""
+        return orjson.dumps(self.health_check())
+    
+    def procesar_solicitud(self, mensaje):
         """
         Procesa una solicitud recibida vía ZeroMQ
         
         Args:
-            mensaje_json: JSON string con la solicitud
+            mensaje: Bytes o memoryview JSON (UTF-8) con la solicitud, tal como llegan del socket
         
         Returns:
-            JSON string con la respuesta
+            Bytes JSON (UTF-8) con la respuesta, listos para enviar por el socket
         """
         try:
-            solicitud = json.loads(mensaje_json)
+            solicitud = orjson.loads(mensaje)
             operacion = solicitud.get('operacion', '').upper()
             
             self.contador_operaciones += 1
-            logger.info(f"Operación #{self.contador_operaciones}: {operacion}")
-            
-            if operacion == 'GET_BOOK':
-                libro_id = solicitud.get('libro_id')
-                search_criteria = solicitud.get('search_criteria')
-                libro = self.get_book(libro_id, search_criteria)
-                if libro:
-                    return json.dumps({"success": True, "libro": libro}, ensure_ascii=False)
-                else:
-                    return json.dumps({"success": False, "message": "Libro no encontrado"}, ensure_ascii=False)
-            
-            elif operacion == 'LOAN_BOOK':
-                libro_id = solicitud.get('libro_id')
-                usuario_id = solicitud.get('usuario_id')
-                sede = solicitud.get('sede', 'SEDE_1')
-                resultado = self.loan_book(libro_id, usuario_id, sede)
-                return json.dumps(resultado, ensure_ascii=False)
-            
-            elif operacion == 'RETURN_BOOK':
-                libro_id = solicitud.get('libro_id')
-                usuario_id = solicitud.get('usuario_id')
-                sede = solicitud.get('sede', 'SEDE_1')
-                resultado = self.return_book(libro_id, usuario_id, sede)
-                return json.dumps(resultado, ensure_ascii=False)
+            logger.info("Operación #%d: %s", self.contador_operaciones, operacion)
             
-            elif operacion == 'RENEW_BOOK':
-                libro_id = solicitud.get('libro_id')
-                usuario_id = solicitud.get('usuario_id')
-                sede = solicitud.get('sede', 'SEDE_1')
-                nueva_fecha = solicitud.get('nueva_fecha')
-                resultado = self.renew_book(libro_id, usuario_id, sede, nueva_fecha)
-                return json.dumps(resultado, ensure_ascii=False)
-            
-            elif operacion == 'UPDATE_COPIES':
-                libro_id = solicitud.get('libro_id')
-                cambios = solicitud.get('cambios', {})
-                resultado = self.update_copies(libro_id, cambios)
-                return json.dumps(resultado, ensure_ascii=False)
-            
-            elif operacion == 'HEALTH_CHECK':
-                resultado = self.health_check()
-                return json.dumps(resultado, ensure_ascii=False)
-            
-            else:
-                return json.dumps({"success": False, "message": f"Operación desconocida: {operacion}"}, ensure_ascii=False)
+            handler = self._ops.get(operacion)
+            if handler:
+                return handler(solicitud)
+            return orjson.dumps({"success": False, "message": f"Operación desconocida: {operacion}"})
         
-        except json.JSONDecodeError as e:
+        except orjson.JSONDecodeError as e:
             logger.error(f"Error parseando solicitud JSON: {e}")
-            return json.dumps({"success": False, "message": "Formato JSON inválido"}, ensure_ascii=False)
+            return orjson.dumps({"success": False, "message": "Formato JSON inválido"})
         except Exception as e:
             logger.error(f"Error procesando solicitud: {e}")
-            return json.dumps({"success": False, "message": f"Error interno: {str(e)}"}, ensure_ascii=False)
+            return orjson.dumps({"success": False, "message": f"Error interno: {str(e)}"})
     
     def inicializar_socket(self):
         """Inicializa el socket REP"""
@@ -547,17 +773,18 @@ class GestorAlmacenamiento:
         
         while self.running:
             try:
-                # Recibir solicitud
-                mensaje = self.rep_socket.recv(zmq.NOBLOCK)
-                mensaje_str = mensaje.decode('utf-8')
+                # Recibir solicitud como zmq.Frame (sin copiar a un objeto bytes)
+                frame = self.rep_socket.recv(zmq.NOBLOCK, copy=False)
                 
-                logger.debug(f"Solicitud recibida: {mensaje_str}")
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug("Solicitud recibida: %s", frame.bytes.decode(errors='replace'))
                 
-                # Procesar solicitud
-                respuesta = self.procesar_solicitud(mensaje_str)
+                # Procesar solicitud: orjson parsea directamente el memoryview del frame
+                respuesta = self.procesar_solicitud(frame.buffer)
                 
-                # Enviar respuesta
-                self.rep_socket.send(respuesta.encode('utf-8'))
+                # Enviar respuesta; con copy=False pyzmq evita la copia para respuestas
+                # grandes (GET_BOOK) y sigue copiando las pequeñas (bajo zmq.COPY_THRESHOLD)
+                self.rep_socket.send(respuesta, copy=False)
                 
             except zmq.Again:
                 # No hay mensajes disponibles
@@ -573,10 +800,15 @@ class GestorAlmacenamiento:
             logger.info("Iniciando Gestor de Almacenamiento...")
             self.inicializar_socket()
             
+            # Thread de snapshots periódicos del WAL
+            self.snapshot_thread = threading.Thread(target=self._snapshot_loop, daemon=True)
+            self.snapshot_thread.start()
+            
             logger.info("Gestor de Almacenamiento iniciado correctamente")
             logger.info(f"Esperando solicitudes en puerto {self.port}...")
             logger.info(f"Réplica primaria: {self.primary_path}")
             logger.info(f"Réplica secundaria: {self.secondary_path}")
+            logger.info(f"WAL: {self.wal_path} (snapshot cada {self.snapshot_ops} operaciones o {self.snapshot_interval}s)")
             
             self.manejar_solicitudes()
             
@@ -591,6 +823,19 @@ class GestorAlmacenamiento:
         """Detiene el Gestor de Almacenamiento"""
         self.running = False
         
+        # Despertar y esperar al thread de snapshots para que no compita con el cierre del WAL
+        self.snapshot_evento.set()
+        if self.snapshot_thread and self.snapshot_thread is not threading.current_thread():
+            self.snapshot_thread.join(timeout=5)
+        
+        # Volcar el WAL pendiente a un snapshot antes de salir
+        if self.wal:
+            if self.ops_desde_snapshot > 0:
+                self._guardar_snapshot()
+            with self.estado_lock:
+                self.wal.close()
+                self.wal = None
+        
         if self.rep_socket:
             self.rep_socket.close()
         if self.context:
@@ -601,19 +846,25 @@ class GestorAlmacenamiento:
 
 def main():
     """Función principal"""
-    import sys
+    configurar_logging('GA')
     
     # Leer variables de entorno
     primary_path = os.getenv('GA_PRIMARY_PATH', 'data/primary/libros.json')
     secondary_path = os.getenv('GA_SECONDARY_PATH', 'data/secondary/libros.json')
     port = int(os.getenv('GA_PORT', '5003'))
     host = os.getenv('GA_HOST', '0.0.0.0')
+    snapshot_ops = int(os.getenv('GA_SNAPSHOT_OPS', '100'))
+    snapshot_interval = float(os.getenv('GA_SNAPSHOT_INTERVAL', '5'))
+    json_indent = os.getenv('GA_JSON_INDENT', '0') == '1'
     
     ga = GestorAlmacenamiento(
         primary_path=primary_path,
         secondary_path=secondary_path,
         port=port,
-        host=host
+        host=host,
+        snapshot_ops=snapshot_ops,
+        snapshot_interval=snapshot_interval,
+        json_indent=json_indent
     )
     ga.iniciar()
 
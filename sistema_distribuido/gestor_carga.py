@@ -6,31 +6,69 @@ Maneja las solicitudes de renovación, devolución y préstamo usando ZeroMQ REQ
 """
 
 import zmq
-import json
+import orjson
 import threading
 import time
 import os
-import queue
+import itertools
+from collections import deque
 from datetime import datetime, timedelta
 import logging
 from utils_failover import FailoverManager
+from utils_logging import configurar_logging
 
-# Configurar logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - GC - %(levelname)s - %(message)s',
-    datefmt='%Y-%m-%d %H:%M:%S'
-)
 logger = logging.getLogger(__name__)
 
 class GestorCarga:
+    # Topics PUB/SUB ya codificados: se reutilizan en cada publicación
+    TOPIC_BYTES = {
+        'RENOVACION': b'renovacion',
+        'DEVOLUCION': b'devolucion'
+    }
+    # Respuestas pre-serializadas del camino común (RENOVACION/DEVOLUCION aceptadas);
+    # el libro_id se inserta ya escapado como string JSON
+    RESP_ASYNC_OK = {
+        'RENOVACION': b'{"status":"OK","message":"Recibido. Procesando...","operacion":"RENOVACION","libro_id":%s}',
+        'DEVOLUCION': b'{"status":"OK","message":"Recibido. Procesando...","operacion":"DEVOLUCION","libro_id":%s}'
+    }
+    RESP_OP_INVALIDA = ('{"status":"ERROR","message":"Operación inválida: %s. '
+                        'Solo se permiten PRESTAMO, RENOVACION y DEVOLUCION"}').encode('utf-8')
+    RESP_JSON_INVALIDO = '{"status":"ERROR","message":"Formato JSON inválido"}'.encode('utf-8')
+    # Eventos PUB de esquema fijo: libro_id, usuario_id y sede se insertan ya escapados
+    # como strings JSON; timestamp y fecha son ASCII generados por el propio GC
+    EVENTO_TMPL = {
+        'RENOVACION': (b'{"operacion":"RENOVACION","libro_id":%s,"usuario_id":%s,"sede":%s,'
+                       b'"timestamp":"%s","nueva_fecha_devolucion":"%s"}'),
+        'DEVOLUCION': (b'{"operacion":"DEVOLUCION","libro_id":%s,"usuario_id":%s,"sede":%s,'
+                       b'"timestamp":"%s"}')
+    }
+    # Límite de mensajes encolados en el socket frontal (REP o ROUTER) hacia/desde PS
+    FRONTEND_HWM = 10000
+    # Endpoint inproc donde el DEALER reparte solicitudes a los workers (modo multithread)
+    WORKERS_ADDRESS = "inproc://workers"
+    
     def __init__(self):
-        self.context = zmq.Context()
-        self.rep_socket = None  # Socket REP para recibir de PS
+        # Varios hilos de E/S para que REP/ROUTER, PUB y los REQ hacia actor_prestamo avancen en paralelo
+        self.context = zmq.Context(io_threads=max(2, (os.cpu_count() or 2) // 2))
+        self.rep_socket = None  # Socket REP para recibir de PS (solo modo serial)
+        self.router_socket = None  # Socket ROUTER frontal para PS (solo modo multithread)
+        self.dealer_socket = None  # Socket DEALER inproc hacia los workers (solo modo multithread)
         self.pub_socket = None  # Socket PUB para enviar eventos a actores
+        self.pub_lock = threading.Lock()  # Los sockets ZeroMQ no son thread-safe
+        self._pub_queue = deque()  # Eventos (topic, bytes) pendientes de publicar tras responder a PS
         self.req_actor_prestamo = None  # Socket REQ para comunicarse con actor_prestamo (solo modo serial)
-        self.contador_operaciones = 0
-        self.contador_lock = threading.Lock()  # Lock para contador thread-safe
+        self.poller = None  # Poller sobre rep_socket para esperar solicitudes sin busy-wait
+        # Contador de operaciones: next() sobre itertools.count es atómico bajo el GIL, sin lock
+        self._contador_iter = itertools.count(1)
+        # Marcas de tiempo cacheadas por segundo, ya en bytes: (segundo_epoch, timestamp_iso, fecha_renovacion)
+        self._cached_ts = (0, b'', b'')
+        
+        # Tabla de despacho: operación -> handler(datos, req_socket, mensaje) (un solo lookup por solicitud)
+        self._ops = {
+            'PRESTAMO': self.procesar_prestamo,
+            'RENOVACION': self._crear_handler_asincrono('RENOVACION'),
+            'DEVOLUCION': self._crear_handler_asincrono('DEVOLUCION')
+        }
         self.running = True
         
         # Leer variables de entorno
@@ -39,6 +77,15 @@ class GestorCarga:
         self.gc_pub_port = int(os.getenv('GC_PUB_PORT', '5002'))
         self.actor_prestamo_host = os.getenv('ACTOR_PRESTAMO_HOST', 'actor_prestamo')
         self.actor_prestamo_port = int(os.getenv('ACTOR_PRESTAMO_PORT', '5004'))
+        # Transporte hacia actor_prestamo: 'tcp' (default) o 'ipc' si comparten host
+        actor_transport = os.getenv('ACTOR_PRESTAMO_TRANSPORT', 'tcp').lower()
+        if actor_transport == 'ipc':
+            ipc_path = os.getenv('ACTOR_PRESTAMO_IPC_PATH', '/tmp/actor_prestamo.sock')
+            self.actor_prestamo_address = f"ipc://{ipc_path}"
+        else:
+            if actor_transport != 'tcp':
+                logger.warning(f"Transporte inválido '{actor_transport}', usando 'tcp' por defecto")
+            self.actor_prestamo_address = f"tcp://{self.actor_prestamo_host}:{self.actor_prestamo_port}"
         self.ga_host = os.getenv('GA_HOST', 'ga')
         self.ga_port = int(os.getenv('GA_PORT', '5003'))
         
@@ -49,12 +96,12 @@ class GestorCarga:
             gc_mode = 'serial'
         self.modo = gc_mode
         self.num_workers = int(os.getenv('GC_WORKERS', '4'))
+        # GC_PUB_BATCH=1: los eventos consecutivos del mismo topic viajan en un solo multipart
+        # [topic, evento1, evento2, ...]; los actores iteran los frames de datos
+        self.pub_batch = os.getenv('GC_PUB_BATCH', '0') == '1'
         
         if self.modo == 'multithread':
             logger.info(f"Modo multithread activado con {self.num_workers} workers")
-            # Colas para comunicación thread-safe entre main thread y workers
-            self.request_queue = queue.Queue()
-            self.response_queue = queue.Queue()
             self.workers = []  # Lista de threads workers
         else:
             logger.info("Modo serial activado (comportamiento original)")
@@ -69,20 +116,47 @@ class GestorCarga:
         
         # Thread para health checks periódicos
         self.health_check_thread = None
-        self.health_check_running = True
+        self.health_check_interval = 30  # segundos
+        self._hc_stop = threading.Event()  # Permite cancelar la espera del health check al detener
         
     def inicializar_sockets(self):
         """Inicializa los sockets REQ/REP, PUB/SUB y REQ para actor_prestamo"""
         try:
-            # Socket REP para recibir solicitudes del Proceso Solicitante
-            self.rep_socket = self.context.socket(zmq.REP)
             bind_address = f"tcp://{self.gc_host}:{self.gc_rep_port}"
-            self.rep_socket.bind(bind_address)
-            logger.info(f"Socket REP inicializado en {bind_address}")
+            if self.modo == 'multithread':
+                # ROUTER frontal para el Proceso Solicitante y DEALER inproc hacia los workers;
+                # zmq.proxy reparte las solicitudes y devuelve cada respuesta a su cliente
+                self.router_socket = self.context.socket(zmq.ROUTER)
+                self.router_socket.setsockopt(zmq.LINGER, 0)  # No bloquear el cierre con respuestas pendientes
+                # HWM acotados: bajo sobrecarga se aplica contrapresión en vez de crecer en memoria
+                self.router_socket.setsockopt(zmq.RCVHWM, self.FRONTEND_HWM)
+                self.router_socket.setsockopt(zmq.SNDHWM, self.FRONTEND_HWM)
+                self.router_socket.bind(bind_address)
+                logger.info(f"Socket ROUTER inicializado en {bind_address}")
+                
+                self.dealer_socket = self.context.socket(zmq.DEALER)
+                self.dealer_socket.setsockopt(zmq.LINGER, 0)
+                self.dealer_socket.bind(self.WORKERS_ADDRESS)
+                logger.info(f"Socket DEALER inicializado en {self.WORKERS_ADDRESS}")
+            else:
+                # Socket REP para recibir solicitudes del Proceso Solicitante
+                self.rep_socket = self.context.socket(zmq.REP)
+                self.rep_socket.setsockopt(zmq.RCVTIMEO, -1)  # recv bloqueante: la espera la hace el poller
+                self.rep_socket.setsockopt(zmq.LINGER, 0)  # No bloquear el cierre con respuestas pendientes
+                self.rep_socket.setsockopt(zmq.RCVHWM, self.FRONTEND_HWM)
+                self.rep_socket.setsockopt(zmq.SNDHWM, self.FRONTEND_HWM)
+                self.rep_socket.bind(bind_address)
+                logger.info(f"Socket REP inicializado en {bind_address}")
+                
+                # Poller para bloquear hasta que llegue una solicitud (timeout para revisar self.running)
+                self.poller = zmq.Poller()
+                self.poller.register(self.rep_socket, zmq.POLLIN)
             
             # Socket PUB para enviar eventos a los actores (devolución y renovación)
-            # Compartido entre threads en modo multithread (thread-safe en ZeroMQ)
+            # Compartido entre workers en modo multithread, protegido por pub_lock
             self.pub_socket = self.context.socket(zmq.PUB)
+            self.pub_socket.setsockopt(zmq.SNDHWM, 100000)  # Absorber ráfagas sin descartar eventos
+            self.pub_socket.setsockopt(zmq.LINGER, 0)
             bind_address_pub = f"tcp://{self.gc_host}:{self.gc_pub_port}"
             self.pub_socket.bind(bind_address_pub)
             logger.info(f"Socket PUB inicializado en {bind_address_pub}")
@@ -90,216 +164,285 @@ class GestorCarga:
             # Socket REQ para comunicarse con actor_prestamo
             # Solo en modo serial; en modo multithread cada worker tiene su propio socket
             if self.modo == 'serial':
-                self.req_actor_prestamo = self.context.socket(zmq.REQ)
-                self.req_actor_prestamo.setsockopt(zmq.RCVTIMEO, 10000)  # 10 segundos timeout
-                actor_address = f"tcp://{self.actor_prestamo_host}:{self.actor_prestamo_port}"
-                self.req_actor_prestamo.connect(actor_address)
-                logger.info(f"Socket REQ conectado a Actor Préstamo en {actor_address}")
-            
-            # Pequeña pausa para asegurar que los sockets estén listos
-            time.sleep(1)
+                self.req_actor_prestamo = self._crear_socket_actor_prestamo()
+                logger.info(f"Socket REQ conectado a Actor Préstamo en {self.actor_prestamo_address}")
             
         except Exception as e:
             logger.error(f"Error inicializando sockets: {e}")
             raise
     
-    def procesar_solicitud(self, mensaje_json, req_socket=None):
+    def _crear_socket_actor_prestamo(self):
+        """Crea un socket REQ conectado a actor_prestamo con timeouts de envío y recepción"""
+        req_socket = self.context.socket(zmq.REQ)
+        req_socket.setsockopt(zmq.RCVTIMEO, 10000)  # 10 segundos timeout
+        # Con IMMEDIATE el envío no se encola hacia una conexión aún no establecida;
+        # SNDTIMEO evita que ese envío bloquee indefinidamente si el actor no está arriba
+        req_socket.setsockopt(zmq.IMMEDIATE, 1)
+        req_socket.setsockopt(zmq.SNDTIMEO, 5000)
+        req_socket.setsockopt(zmq.CONNECT_TIMEOUT, 2000)
+        # Tras un timeout de recv el socket puede volver a enviar (RELAXED) y las
+        # respuestas tardías de la solicitud abandonada se descartan (CORRELATE)
+        req_socket.setsockopt(zmq.REQ_RELAXED, 1)
+        req_socket.setsockopt(zmq.REQ_CORRELATE, 1)
+        req_socket.setsockopt(zmq.LINGER, 0)
+        req_socket.connect(self.actor_prestamo_address)
+        return req_socket
+    
+    def procesar_solicitud(self, mensaje, req_socket=None):
         """Procesa una solicitud y genera el evento correspondiente o reenvía a actor_prestamo
         
         Args:
-            mensaje_json: Mensaje JSON con la solicitud
+            mensaje: Bytes JSON con la solicitud (tal como llegan del socket)
             req_socket: Socket REQ a usar para préstamos (None para modo serial)
+        
+        Returns:
+            Bytes JSON con la respuesta, listos para enviar
         """
         try:
-            datos = json.loads(mensaje_json)
-            operacion = datos.get('op', '').upper()
-            libro_id = datos.get('libro_id', '')
-            usuario_id = datos.get('usuario_id', '')
-            sede = datos.get('sede', 'SEDE_1')
-            search_criteria = datos.get('search_criteria')
+            datos = orjson.loads(mensaje)
+            operacion = datos.get('op', '')
             
-            # Procesar PRESTAMO de forma síncrona vía REQ/REP con actor_prestamo
-            if operacion == 'PRESTAMO':
-                return self.procesar_prestamo(datos, req_socket=req_socket)
-            
-            # Procesar RENOVACION y DEVOLUCION de forma asíncrona vía PUB/SUB
-            elif operacion in ['RENOVACION', 'DEVOLUCION']:
-                return self.procesar_operacion_asincrona(operacion, libro_id, usuario_id, sede)
-            
-            else:
-                return {
-                    "status": "ERROR",
-                    "message": f"Operación inválida: {operacion}. Solo se permiten PRESTAMO, RENOVACION y DEVOLUCION"
-                }
+            # PRESTAMO se procesa de forma síncrona vía REQ/REP con actor_prestamo;
+            # RENOVACION y DEVOLUCION de forma asíncrona vía PUB/SUB.
+            # Los clientes envían la operación en mayúsculas: solo se normaliza si no coincide
+            handler = self._ops.get(operacion)
+            if handler is None:
+                operacion = operacion.upper()
+                handler = self._ops.get(operacion)
+            if handler is None:
+                # orjson escapa la operación; se quitan las comillas para insertarla en el mensaje
+                return self.RESP_OP_INVALIDA % orjson.dumps(operacion)[1:-1]
+            return handler(datos, req_socket, mensaje)
             
-        except json.JSONDecodeError as e:
+        except orjson.JSONDecodeError as e:
             logger.error(f"Error parseando JSON: {e}")
-            return {
-                "status": "ERROR",
-                "message": "Formato JSON inválido"
-            }
+            return self.RESP_JSON_INVALIDO
         except Exception as e:
             logger.error(f"Error procesando solicitud: {e}")
-            return {
+            return orjson.dumps({
                 "status": "ERROR",
                 "message": f"Error interno: {str(e)}"
-            }
+            })
     
-    def procesar_prestamo(self, datos, req_socket=None):
+    def procesar_prestamo(self, datos, req_socket=None, mensaje=None):
         """Procesa una solicitud de préstamo reenviándola a actor_prestamo
         
         Args:
             datos: Datos de la solicitud
             req_socket: Socket REQ a usar (None para usar self.req_actor_prestamo en modo serial)
+            mensaje: Bytes originales de la solicitud; si se dan se reenvían sin volver a serializar
         """
         try:
             # Usar socket proporcionado o el socket compartido (modo serial)
             socket_a_usar = req_socket if req_socket is not None else self.req_actor_prestamo
             
-            # Crear solicitud para actor_prestamo
-            solicitud_prestamo = {
-                "operacion": "PRESTAMO",
-                "libro_id": datos.get('libro_id'),
-                "usuario_id": datos.get('usuario_id'),
-                "sede": datos.get('sede', 'SEDE_1'),
-                "search_criteria": datos.get('search_criteria')
-            }
-            
-            solicitud_json = json.dumps(solicitud_prestamo, ensure_ascii=False)
+            # actor_prestamo acepta el formato del PS ('op') y aplica la sede por defecto,
+            # así que los bytes recibidos se reenvían sin tocarlos
+            if mensaje is not None:
+                solicitud_json = mensaje
+            else:
+                datos['operacion'] = 'PRESTAMO'
+                datos.setdefault('sede', 'SEDE_1')
+                solicitud_json = orjson.dumps(datos)
             
-            logger.info(f"Reenviando préstamo a Actor Préstamo: {solicitud_json}")
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Reenviando préstamo a Actor Préstamo: %s", solicitud_json.decode())
             
             # Enviar a actor_prestamo
-            socket_a_usar.send(solicitud_json.encode('utf-8'))
+            socket_a_usar.send(solicitud_json, copy=False)
             
             # Recibir respuesta
-            respuesta_bytes = socket_a_usar.recv()
-            respuesta_str = respuesta_bytes.decode('utf-8')
-            respuesta = json.loads(respuesta_str)
+            respuesta = orjson.loads(socket_a_usar.recv())
             
-            # Incrementar contador de forma thread-safe
-            with self.contador_lock:
-                self.contador_operaciones += 1
-                contador_actual = self.contador_operaciones
+            contador_actual = next(self._contador_iter)
             
             if respuesta.get('success'):
-                logger.info(f"Préstamo #{contador_actual} exitoso: {respuesta.get('message')}")
-                return {
+                logger.info("Préstamo #%d exitoso: %s", contador_actual, respuesta.get('message'))
+                return orjson.dumps({
                     "status": "OK",
                     "message": respuesta.get('message'),
                     "operacion": "PRESTAMO",
                     "libro_id": respuesta.get('libro_id'),
                     "ejemplar_id": respuesta.get('ejemplar_id'),
                     "fecha_devolucion": respuesta.get('fecha_devolucion')
-                }
+                })
             else:
-                logger.error(f"Préstamo #{contador_actual} falló: {respuesta.get('message')}")
-                return {
+                logger.error("Préstamo #%d falló: %s", contador_actual, respuesta.get('message'))
+                return orjson.dumps({
                     "status": "ERROR",
                     "message": respuesta.get('message'),
                     "operacion": "PRESTAMO"
-                }
+                })
         
         except zmq.Again:
             logger.error("Timeout esperando respuesta de Actor Préstamo")
-            return {
+            return orjson.dumps({
                 "status": "ERROR",
                 "message": "Timeout: Actor Préstamo no respondió"
-            }
+            })
         except Exception as e:
             logger.error(f"Error procesando préstamo: {e}")
-            return {
+            return orjson.dumps({
                 "status": "ERROR",
                 "message": f"Error comunicándose con Actor Préstamo: {str(e)}"
-            }
+            })
     
-    def procesar_operacion_asincrona(self, operacion, libro_id, usuario_id, sede):
-        """Procesa operaciones asíncronas (RENOVACION, DEVOLUCION)"""
-        # Crear evento con timestamp
-        timestamp = datetime.utcnow().isoformat()
-        evento = {
-            "operacion": operacion,
-            "libro_id": libro_id,
-            "usuario_id": usuario_id,
-            "sede": sede,
-            "timestamp": timestamp
-        }
+    def _marcas_de_tiempo(self):
+        """Devuelve (timestamp_iso, fecha_renovacion) en bytes, recalculándolos como mucho una vez por segundo"""
+        segundo = int(time.time())
+        cache = self._cached_ts
+        if segundo != cache[0]:
+            # Timestamp UTC del evento y nueva fecha de devolución local (+7 días)
+            timestamp = datetime.utcfromtimestamp(segundo).isoformat().encode('ascii')
+            fecha_renovacion = (datetime.fromtimestamp(segundo) + timedelta(days=7)).strftime('%Y-%m-%d').encode('ascii')
+            cache = (segundo, timestamp, fecha_renovacion)
+            # La asignación de la tupla es atómica: los workers ven el par antiguo o el nuevo
+            self._cached_ts = cache
+        return cache[1], cache[2]
+    
+    def _crear_handler_asincrono(self, operacion):
+        """Crea el handler especializado de una operación asíncrona (RENOVACION o DEVOLUCION)
+        
+        La forma del evento y la plantilla de respuesta se deciden aquí una sola vez;
+        el handler resultante tiene la firma de la tabla de despacho: handler(datos, req_socket, mensaje).
+        """
+        resp_ok = self.RESP_ASYNC_OK[operacion]
+        evento_tmpl = self.EVENTO_TMPL[operacion]
         
-        # Para renovación, calcular nueva fecha de devolución (+7 días)
         if operacion == 'RENOVACION':
-            nueva_fecha = (datetime.now() + timedelta(days=7)).strftime('%Y-%m-%d')
-            evento["nueva_fecha_devolucion"] = nueva_fecha
+            def construir_evento(libro_id_json, usuario_id_json, sede_json):
+                # Evento con nueva fecha de devolución (+7 días)
+                timestamp, fecha_renovacion = self._marcas_de_tiempo()
+                return evento_tmpl % (libro_id_json, usuario_id_json, sede_json, timestamp, fecha_renovacion)
+        else:
+            def construir_evento(libro_id_json, usuario_id_json, sede_json):
+                timestamp, _ = self._marcas_de_tiempo()
+                return evento_tmpl % (libro_id_json, usuario_id_json, sede_json, timestamp)
         
-        # Enviar evento a los actores correspondientes
-        self.enviar_evento_a_actores(evento)
+        def handler(datos, req_socket=None, mensaje=None):
+            libro_id = datos.get('libro_id', '')
+            usuario_id = datos.get('usuario_id', '')
+            libro_id_json = orjson.dumps(libro_id)
+            
+            # Construir los bytes del evento directamente desde la plantilla y enviarlos
+            mensaje_evento = construir_evento(libro_id_json, orjson.dumps(usuario_id),
+                                              orjson.dumps(datos.get('sede', 'SEDE_1')))
+            self.enviar_evento_a_actores(operacion, mensaje_evento)
+            
+            contador_actual = next(self._contador_iter)
+            
+            logger.info("Operación #%d procesada: %s - Libro %s - Usuario %s",
+                        contador_actual, operacion, libro_id, usuario_id)
+            
+            return resp_ok % libro_id_json
         
-        # Incrementar contador de forma thread-safe
-        with self.contador_lock:
-            self.contador_operaciones += 1
-            contador_actual = self.contador_operaciones
+        return handler
+    
+    def enviar_evento_a_actores(self, operacion, mensaje_evento):
+        """Encola el evento para los actores correspondientes vía PUB/SUB
         
-        logger.info(f"Operación #{contador_actual} procesada: {operacion} - Libro {libro_id} - Usuario {usuario_id}")
+        El envío real lo hace _vaciar_eventos_pub después de responder al Proceso Solicitante.
         
-        return {
-            "status": "OK",
-            "message": "Recibido. Procesando...",
-            "operacion": operacion,
-            "libro_id": libro_id
-        }
+        Args:
+            operacion: 'RENOVACION' o 'DEVOLUCION'
+            mensaje_evento: Evento ya serializado como bytes JSON
+        """
+        # deque.append es thread-safe; topic b'renovacion' o b'devolucion'
+        self._pub_queue.append((self.TOPIC_BYTES[operacion], mensaje_evento))
     
-    def enviar_evento_a_actores(self, evento):
-        """Envía el evento a los actores correspondientes vía PUB/SUB"""
+    def _vaciar_eventos_pub(self):
+        """Publica en un bucle cerrado todos los eventos encolados"""
+        if not self._pub_queue:
+            return
         try:
-            operacion = evento['operacion']
-            topic = operacion.lower()  # 'renovacion' o 'devolucion'
-            
-            # Serializar evento como JSON
-            mensaje_evento = json.dumps(evento, ensure_ascii=False)
-            
-            # Enviar con el topic correspondiente
-            self.pub_socket.send_multipart([topic.encode('utf-8'), mensaje_evento.encode('utf-8')])
-            
-            logger.info(f"Evento enviado a actores - Topic: {topic} - Evento: {evento}")
-            
+            with self.pub_lock:
+                if self.pub_batch:
+                    self._vaciar_eventos_pub_en_lotes()
+                    return
+                while self._pub_queue:
+                    topic, mensaje_evento = self._pub_queue[0]
+                    # PUB no bloquea (descarta al llegar al HWM); DONTWAIT por si acaso.
+                    # Se desencola solo tras enviar, para reintentar en el próximo vaciado
+                    # copy=False: los bytes de orjson son inmutables y pyzmq los referencia sin
+                    # copiarlos (por debajo de zmq.COPY_THRESHOLD pyzmq decide copiar igualmente)
+                    self.pub_socket.send_multipart([topic, mensaje_evento], flags=zmq.DONTWAIT,
+                                                   copy=False, track=False)
+                    self._pub_queue.popleft()
+                    
+                    if logger.isEnabledFor(logging.INFO):
+                        logger.info("Evento enviado a actores - Topic: %s - Evento: %s",
+                                    topic.decode(), mensaje_evento.decode())
+        except zmq.Again:
+            logger.warning("Socket PUB saturado, eventos pendientes: %d", len(self._pub_queue))
         except Exception as e:
             logger.error(f"Error enviando evento a actores: {e}")
     
-    def _worker_loop(self, worker_id, req_socket):
+    def _vaciar_eventos_pub_en_lotes(self):
+        """Publica los eventos encolados agrupando los consecutivos del mismo topic (requiere pub_lock)
+        
+        El filtro de SUB solo mira el primer frame, así que un lote nunca mezcla topics.
+        """
+        cola = self._pub_queue
+        while cola:
+            topic = cola[0][0]
+            frames = [topic]
+            # Por índice y no iterando: otros hilos pueden añadir eventos mientras tanto
+            for i in range(len(cola)):
+                topic_evento, mensaje_evento = cola[i]
+                if topic_evento != topic:
+                    break
+                frames.append(mensaje_evento)
+            self.pub_socket.send_multipart(frames, flags=zmq.DONTWAIT, copy=False, track=False)
+            for _ in range(len(frames) - 1):
+                cola.popleft()
+            
+            if logger.isEnabledFor(logging.INFO):
+                for mensaje_evento in frames[1:]:
+                    logger.info("Evento enviado a actores - Topic: %s - Evento: %s",
+                                topic.decode(), mensaje_evento.decode())
+    
+    def _worker_loop(self, worker_id, rep_socket, req_socket):
         """Loop de trabajo para un worker thread en modo multithread
         
         Args:
             worker_id: ID del worker
+            rep_socket: Socket REP propio del worker, conectado al DEALER inproc
             req_socket: Socket REQ propio del worker para comunicarse con actor_prestamo
         """
         logger.info(f"Worker {worker_id} iniciado")
         
+        poller = zmq.Poller()
+        poller.register(rep_socket, zmq.POLLIN)
+        
         while self.running:
             try:
-                # Obtener solicitud de la cola (con timeout para poder verificar self.running)
-                try:
-                    request_data = self.request_queue.get(timeout=1.0)
-                except queue.Empty:
+                # Esperar solicitud (con timeout para poder verificar self.running)
+                socks = dict(poller.poll(timeout=1000))
+                if rep_socket not in socks:
                     continue
+                mensaje = rep_socket.recv()
                 
-                mensaje_str, request_id = request_data
-                
-                logger.info(f"Worker {worker_id} procesando solicitud {request_id}: {mensaje_str}")
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug("Worker %d procesando solicitud: %s", worker_id, mensaje.decode())
                 
                 # Procesar solicitud (pasar req_socket para préstamos)
-                respuesta = self.procesar_solicitud(mensaje_str, req_socket=req_socket)
+                respuesta_json = self.procesar_solicitud(mensaje, req_socket=req_socket)
                 
-                # Enviar respuesta a la cola de respuestas
-                respuesta_json = json.dumps(respuesta, ensure_ascii=False)
-                self.response_queue.put((request_id, respuesta_json))
+                # Responder; el proxy ROUTER/DEALER la enruta al cliente original
+                rep_socket.send(respuesta_json, copy=False)
+                self._vaciar_eventos_pub()
                 
-                logger.info(f"Worker {worker_id} completó solicitud {request_id}")
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug("Worker %d respuesta enviada: %s", worker_id, respuesta_json.decode())
                 
+            except zmq.ContextTerminated:
+                break
             except Exception as e:
                 logger.error(f"Error en worker {worker_id}: {e}")
         
-        # Cerrar socket del worker
-        if req_socket:
-            req_socket.close()
+        # Cerrar sockets del worker
+        rep_socket.close(linger=0)
+        req_socket.close(linger=0)
         logger.info(f"Worker {worker_id} detenido")
     
     def _iniciar_workers(self):
@@ -307,23 +450,23 @@ class GestorCarga:
         logger.info(f"Iniciando {self.num_workers} workers...")
         
         for i in range(self.num_workers):
+            # Cada worker recibe solicitudes por su propio socket REP conectado al DEALER
+            rep_socket = self.context.socket(zmq.REP)
+            rep_socket.setsockopt(zmq.LINGER, 0)
+            rep_socket.connect(self.WORKERS_ADDRESS)
+            
             # Cada worker tiene su propio socket REQ para actor_prestamo
-            req_socket = self.context.socket(zmq.REQ)
-            req_socket.setsockopt(zmq.RCVTIMEO, 10000)  # 10 segundos timeout
-            actor_address = f"tcp://{self.actor_prestamo_host}:{self.actor_prestamo_port}"
-            req_socket.connect(actor_address)
+            req_socket = self._crear_socket_actor_prestamo()
             
             worker = threading.Thread(
                 target=self._worker_loop,
-                args=(i + 1, req_socket),
+                args=(i + 1, rep_socket, req_socket),
                 daemon=True
             )
             worker.start()
-            self.workers.append((worker, req_socket))
-            logger.info(f"Worker {i + 1} iniciado con socket REQ conectado a {actor_address}")
+            self.workers.append(worker)
+            logger.info(f"Worker {i + 1} iniciado con socket REQ conectado a {self.actor_prestamo_address}")
         
-        # Pequeña pausa para asegurar que los workers estén listos
-        time.sleep(0.5)
         logger.info(f"Todos los {self.num_workers} workers iniciados")
     
     def manejar_solicitudes(self):
@@ -334,93 +477,54 @@ class GestorCarga:
             # Iniciar workers
             self._iniciar_workers()
             
-            # Contador para IDs de solicitudes
-            request_counter = 0
-            # Diccionario para mapear request_id -> respuesta (para manejar respuestas fuera de orden)
-            pending_responses = {}
-            
-            while self.running:
-                try:
-                    # Recibir solicitud (bloqueante - REP socket requiere request-response pairing)
-                    mensaje = self.rep_socket.recv()
-                    mensaje_str = mensaje.decode('utf-8')
-                    request_counter += 1
-                    request_id = request_counter
-                    
-                    logger.info(f"Solicitud recibida (ID: {request_id}): {mensaje_str}")
-                    
-                    # Enviar a la cola de requests para procesamiento por worker
-                    self.request_queue.put((mensaje_str, request_id))
-                    
-                    # Esperar respuesta del worker, verificando si ya llegó (puede haber llegado antes)
-                    respuesta_json = None
-                    while respuesta_json is None:
-                        # Verificar si la respuesta ya está disponible
-                        if request_id in pending_responses:
-                            respuesta_json = pending_responses.pop(request_id)
-                            break
-                        
-                        # Intentar obtener respuesta de la cola (con timeout corto)
-                        try:
-                            request_id_resp, respuesta_json_temp = self.response_queue.get(timeout=0.1)
-                            if request_id_resp == request_id:
-                                # Esta es la respuesta que esperamos
-                                respuesta_json = respuesta_json_temp
-                                break
-                            else:
-                                # Esta es una respuesta para otra solicitud, guardarla
-                                pending_responses[request_id_resp] = respuesta_json_temp
-                        except queue.Empty:
-                            # Continuar esperando
-                            continue
-                    
-                    # Enviar respuesta de vuelta al cliente (REP socket requiere respuesta antes del siguiente recv)
-                    self.rep_socket.send(respuesta_json.encode('utf-8'))
-                    logger.info(f"Respuesta enviada (ID: {request_id}): {respuesta_json}")
-                    
-                except Exception as e:
-                    logger.error(f"Error manejando solicitudes: {e}")
-                    time.sleep(1)
+            # El proxy bloquea hasta que se termine el contexto
+            try:
+                zmq.proxy(self.router_socket, self.dealer_socket)
+            except zmq.ContextTerminated:
+                logger.info("Proxy ROUTER/DEALER detenido")
         else:
             # Modo serial: comportamiento original
             while self.running:
                 try:
-                    # Recibir solicitud del Proceso Solicitante
-                    mensaje = self.rep_socket.recv(zmq.NOBLOCK)
-                    mensaje_str = mensaje.decode('utf-8')
+                    # Esperar solicitud del Proceso Solicitante sin busy-wait
+                    socks = dict(self.poller.poll(timeout=1000))
+                    if self.rep_socket not in socks:
+                        continue
+                    mensaje = self.rep_socket.recv()
                     
-                    logger.info(f"Solicitud recibida: {mensaje_str}")
+                    if logger.isEnabledFor(logging.DEBUG):
+                        logger.debug("Solicitud recibida: %s", mensaje.decode())
                     
-                    # Procesar solicitud
-                    respuesta = self.procesar_solicitud(mensaje_str)
+                    # Procesar solicitud directamente sobre los bytes recibidos
+                    respuesta_json = self.procesar_solicitud(mensaje)
                     
                     # Enviar respuesta inmediata (REQ/REP pattern)
-                    respuesta_json = json.dumps(respuesta, ensure_ascii=False)
-                    self.rep_socket.send(respuesta_json.encode('utf-8'))
+                    self.rep_socket.send(respuesta_json, copy=False)
+                    self._vaciar_eventos_pub()
                     
-                    logger.info(f"Respuesta enviada: {respuesta_json}")
+                    if logger.isEnabledFor(logging.DEBUG):
+                        logger.debug("Respuesta enviada: %s", respuesta_json.decode())
                     
-                except zmq.Again:
-                    # No hay mensajes disponibles, continuar
-                    time.sleep(0.1)
-                    continue
                 except Exception as e:
                     logger.error(f"Error manejando solicitudes: {e}")
                     time.sleep(1)
     
     def health_check_loop(self):
         """Loop de health checks periódicos a GA"""
-        while self.health_check_running:
+        # Calendario monotónico: un health check lento no desplaza los siguientes
+        proximo = time.monotonic()
+        while not self._hc_stop.is_set():
             try:
                 resultado = self.failover_manager.health_check()
                 if resultado.get('ok'):
-                    logger.debug(f"Health check GA: {resultado.get('status')}")
+                    logger.debug("Health check GA: %s", resultado.get('status'))
                 else:
                     logger.warning(f"Health check GA falló: {resultado.get('message')}")
             except Exception as e:
                 logger.error(f"Error en health check: {e}")
             
-            time.sleep(30)  # Health check cada 30 segundos
+            proximo += self.health_check_interval
+            self._hc_stop.wait(max(0, proximo - time.monotonic()))
     
     def iniciar(self):
         """Inicia el Gestor de Carga"""
@@ -439,7 +543,7 @@ class GestorCarga:
             logger.info(f"Esperando solicitudes en puerto {self.gc_rep_port}...")
             logger.info(f"Listo para publicar eventos en puerto {self.gc_pub_port}...")
             if self.modo == 'serial':
-                logger.info(f"Conectado a Actor Préstamo en {self.actor_prestamo_host}:{self.actor_prestamo_port}")
+                logger.info(f"Conectado a Actor Préstamo en {self.actor_prestamo_address}")
             logger.info(f"Monitoreando GA en {self.ga_host}:{self.ga_port}")
             
             # Iniciar manejo de solicitudes
@@ -455,15 +559,17 @@ class GestorCarga:
     def detener(self):
         """Detiene el Gestor de Carga"""
         self.running = False
-        self.health_check_running = False
+        
+        # Cancelar la espera del health check y esperar a que termine antes de cerrar el failover manager
+        self._hc_stop.set()
+        if self.health_check_thread:
+            self.health_check_thread.join(timeout=5)
         
         # Esperar a que los workers terminen (en modo multithread)
         if self.modo == 'multithread' and self.workers:
             logger.info("Esperando a que los workers terminen...")
-            for worker, req_socket in self.workers:
+            for worker in self.workers:
                 worker.join(timeout=2.0)
-                if req_socket:
-                    req_socket.close()
             logger.info("Todos los workers detenidos")
         
         if self.failover_manager:
@@ -473,16 +579,23 @@ class GestorCarga:
             self.req_actor_prestamo.close()
         if self.rep_socket:
             self.rep_socket.close()
+        if self.router_socket:
+            self.router_socket.close()
+        if self.dealer_socket:
+            self.dealer_socket.close()
         if self.pub_socket:
             self.pub_socket.close()
         if self.context:
             self.context.term()
         
-        logger.info(f"Total de operaciones procesadas: {self.contador_operaciones}")
+        # Consumir un valor más del contador para conocer cuántos se entregaron
+        logger.info(f"Total de operaciones procesadas: {next(self._contador_iter) - 1}")
         logger.info("Gestor de Carga detenido")
 
 def main():
     """Función principal"""
+    # LOG_LEVEL=WARNING omite por completo los logs por solicitud
+    configurar_logging('GC', os.getenv('LOG_LEVEL', 'INFO'))
     gc = GestorCarga()
     gc.iniciar()
 
@@ -8,13 +8,21 @@ Registra tiempos de respuesta, desviación estándar y estadísticas de préstam
 import time
 import csv
 import os
-import statistics
+import math
+import queue
+import threading
+from collections import deque
 from datetime import datetime
-from typing import List, Dict, Optional
+from typing import Dict, Optional
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Filas escritas entre flush explícitos del CSV (también se vacía cuando la cola queda vacía)
+FLUSH_CADA = 100
+# Filas pendientes máximas en la cola del escritor; al llenarse se descarta la más antigua
+MAX_FILAS_PENDIENTES = 4096
+
 class Metricas:
     """Gestiona las métricas del sistema"""
     
@@ -26,15 +34,30 @@ class Metricas:
             archivo_csv: Ruta al archivo CSV donde se guardan las métricas
         """
         self.archivo_csv = archivo_csv
-        self.tiempos_respuesta: List[float] = []
         self.inicio_periodo: Optional[float] = None
         self.periodo_duracion = 120  # 2 minutos en segundos
         
+        # Estadísticas del período en línea (Welford): O(1) por muestra, sin guardar la lista
+        self._n = 0
+        self._media = 0.0
+        self._m2 = 0.0
+        # Instantes de los préstamos de la ventana deslizante de periodo_duracion segundos
+        self._marcas_ventana = deque()
+        
         # Asegurar que el directorio existe
         os.makedirs(os.path.dirname(archivo_csv), exist_ok=True)
         
         # Inicializar archivo CSV si no existe
         self._inicializar_csv()
+        
+        # Mantener el archivo abierto con buffer; se vacía cada FLUSH_CADA filas y al cerrar
+        self._fh = open(self.archivo_csv, 'a', newline='', encoding='utf-8', buffering=65536)
+        self._writer = csv.writer(self._fh)
+        
+        # La escritura a disco se hace en un hilo aparte para no sumar E/S al tiempo de respuesta
+        self._cola_escritura = queue.Queue(maxsize=MAX_FILAS_PENDIENTES)
+        self._hilo_escritor = threading.Thread(target=self._escritor_loop, daemon=True)
+        self._hilo_escritor.start()
     
     def _inicializar_csv(self):
         """Inicializa el archivo CSV con los encabezados"""
@@ -67,44 +90,95 @@ class Metricas:
         if self.inicio_periodo is None:
             self.inicio_periodo = time.time()
         
-        # Agregar tiempo de respuesta
-        self.tiempos_respuesta.append(tiempo_respuesta_ms)
-        
         # Calcular estadísticas del período actual (últimos 2 minutos)
         tiempo_actual = time.time()
         if tiempo_actual - self.inicio_periodo > self.periodo_duracion:
             # Reiniciar período
-            self.tiempos_respuesta = [tiempo_respuesta_ms]
+            self._n = 0
+            self._media = 0.0
+            self._m2 = 0.0
             self.inicio_periodo = tiempo_actual
         
-        # Calcular estadísticas
-        total_prestamos_2min = len(self.tiempos_respuesta)
-        tiempo_promedio_ms = statistics.mean(self.tiempos_respuesta) if self.tiempos_respuesta else 0.0
+        # Agregar tiempo de respuesta (actualización de Welford)
+        self._n += 1
+        delta = tiempo_respuesta_ms - self._media
+        self._media += delta / self._n
+        self._m2 += delta * (tiempo_respuesta_ms - self._media)
         
-        try:
-            desviacion_estandar_ms = statistics.stdev(self.tiempos_respuesta) if len(self.tiempos_respuesta) > 1 else 0.0
-        except statistics.StatisticsError:
-            desviacion_estandar_ms = 0.0
+        # Ventana deslizante de los últimos 2 minutos
+        self._marcas_ventana.append(tiempo_actual)
+        self._podar_ventana(tiempo_actual)
         
-        # Escribir en CSV
-        try:
-            with open(self.archivo_csv, 'a', newline='', encoding='utf-8') as f:
-                writer = csv.writer(f)
-                writer.writerow([
-                    timestamp,
-                    'PRESTAMO',
-                    f"{tiempo_respuesta_ms:.2f}",
-                    libro_id,
-                    'SI' if exito else 'NO',
-                    total_prestamos_2min,
-                    f"{tiempo_promedio_ms:.2f}",
-                    f"{desviacion_estandar_ms:.2f}"
-                ])
-        except Exception as e:
-            logger.error(f"Error escribiendo métricas a CSV: {e}")
+        # Calcular estadísticas
+        total_prestamos_2min = len(self._marcas_ventana)
+        tiempo_promedio_ms = self._media
+        desviacion_estandar_ms = self._desviacion_estandar()
+        
+        # Encolar la fila para el hilo escritor
+        self._encolar_fila((
+            timestamp,
+            'PRESTAMO',
+            f"{tiempo_respuesta_ms:.2f}",
+            libro_id,
+            'SI' if exito else 'NO',
+            total_prestamos_2min,
+            f"{tiempo_promedio_ms:.2f}",
+            f"{desviacion_estandar_ms:.2f}"
+        ))
         
         logger.debug(f"Métrica registrada: {tiempo_respuesta_ms:.2f}ms, Préstamos en 2min: {total_prestamos_2min}, Promedio: {tiempo_promedio_ms:.2f}ms, DesvEst: {desviacion_estandar_ms:.2f}ms")
     
+    def _encolar_fila(self, fila: tuple):
+        """Encola una fila sin bloquear; si la cola está llena descarta la más antigua"""
+        while True:
+            try:
+                self._cola_escritura.put_nowait(fila)
+                return
+            except queue.Full:
+                try:
+                    self._cola_escritura.get_nowait()
+                    logger.warning("Cola de métricas llena, se descarta la fila más antigua")
+                except queue.Empty:
+                    pass
+    
+    def _escritor_loop(self):
+        """Escribe en el CSV las filas encoladas hasta recibir el centinela None"""
+        filas_sin_flush = 0
+        while True:
+            fila = self._cola_escritura.get()
+            if fila is None:
+                break
+            try:
+                self._writer.writerow(fila)
+                filas_sin_flush += 1
+                if filas_sin_flush >= FLUSH_CADA or self._cola_escritura.empty():
+                    self._fh.flush()
+                    filas_sin_flush = 0
+            except Exception as e:
+                logger.error(f"Error escribiendo métricas a CSV: {e}")
+    
+    def _podar_ventana(self, tiempo_actual: float):
+        """Descarta de la ventana los préstamos más antiguos que periodo_duracion"""
+        limite = tiempo_actual - self.periodo_duracion
+        marcas = self._marcas_ventana
+        while marcas and marcas[0] < limite:
+            marcas.popleft()
+    
+    def _desviacion_estandar(self) -> float:
+        """Desviación estándar muestral del período a partir del acumulado de Welford"""
+        if self._n > 1:
+            return math.sqrt(self._m2 / (self._n - 1))
+        return 0.0
+    
+    def cerrar(self):
+        """Espera a que se escriban las filas pendientes y cierra el archivo CSV"""
+        if self._hilo_escritor.is_alive():
+            self._cola_escritura.put(None)
+            self._hilo_escritor.join()
+        if self._fh and not self._fh.closed:
+            self._fh.flush()
+            self._fh.close()
+    
     def obtener_estadisticas(self) -> Dict:
         """
         Obtiene las estadísticas actuales
@@ -112,7 +186,7 @@ class Metricas:
         Returns:
             Dict con estadísticas: total_prestamos, tiempo_promedio_ms, desviacion_estandar_ms, prestamos_2min
         """
-        total_prestamos = len(self.tiempos_respuesta)
+        total_prestamos = self._n
         
         if total_prestamos == 0:
             return {
@@ -122,19 +196,12 @@ class Metricas:
                 "prestamos_2min": 0
             }
         
-        tiempo_promedio_ms = statistics.mean(self.tiempos_respuesta)
-        
-        try:
-            desviacion_estandar_ms = statistics.stdev(self.tiempos_respuesta) if total_prestamos > 1 else 0.0
-        except statistics.StatisticsError:
-            desviacion_estandar_ms = 0.0
+        tiempo_promedio_ms = self._media
+        desviacion_estandar_ms = self._desviacion_estandar()
         
         # Contar préstamos en los últimos 2 minutos
-        tiempo_actual = time.time()
-        if self.inicio_periodo and (tiempo_actual - self.inicio_periodo) <= self.periodo_duracion:
-            prestamos_2min = total_prestamos
-        else:
-            prestamos_2min = 0
+        self._podar_ventana(time.time())
+        prestamos_2min = len(self._marcas_ventana)
         
         return {
             "total_prestamos": total_prestamos,
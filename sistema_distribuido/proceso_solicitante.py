@@ -6,20 +6,19 @@ Envía solicitudes de préstamo, renovación y devolución al Gestor de Carga
 """
 
 import zmq
-import json
+import orjson
 import time
 import os
 from datetime import datetime
 import logging
+from utils_logging import configurar_logging
 from metricas import Metricas, obtener_timestamp_ms, medir_tiempo_respuesta
 
-# Configurar logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - PS - %(levelname)s - %(message)s',
-    datefmt='%Y-%m-%d %H:%M:%S'
-)
 logger = logging.getLogger(__name__)
+# El formato no usa hilo ni proceso: no calcularlos en cada registro
+logging.logThreads = False
+logging.logProcesses = False
+logging.logMultiprocessing = False
 
 class ProcesoSolicitante:
     def __init__(self):
@@ -32,35 +31,59 @@ class ProcesoSolicitante:
         # Leer variables de entorno
         self.gc_host = os.getenv('GC_HOST', 'gc')
         self.gc_port = int(os.getenv('GC_PORT', '5001'))
+        # Solicitudes en vuelo a la vez: 1 = REQ/REP (espera cada respuesta antes de enviar la siguiente);
+        # >1 = DEALER con pipelining, sin pausa entre solicitudes
+        self.max_en_vuelo = max(1, int(os.getenv('PS_MAX_EN_VUELO', '1')))
+        # Tiempo máximo sin recibir ninguna respuesta en modo pipelining
+        self.timeout_respuesta_ms = int(os.getenv('PS_TIMEOUT_MS', '10000'))
+        # Pausa entre solicitudes en segundos para simular carga de trabajo real (0 = sin pausa)
+        self.pausa_s = float(os.getenv('PS_PAUSA_S', '0'))
         
         # Inicializar sistema de métricas
         self.metricas = Metricas()
         
     def conectar_gestor_carga(self):
-        """Conecta al Gestor de Carga usando REQ socket"""
+        """Conecta al Gestor de Carga usando REQ socket (o DEALER si hay pipelining)"""
         try:
-            self.req_socket = self.context.socket(zmq.REQ)
+            # DEALER habla con el REP/ROUTER del GC sin cambios en el servidor: basta con
+            # enviar el sobre [id, b'', payload], que REP devuelve intacto con la respuesta
+            tipo_socket = zmq.REQ if self.max_en_vuelo == 1 else zmq.DEALER
+            self.req_socket = self.context.socket(tipo_socket)
+            # LINGER 0: detener() no se queda esperando mensajes pendientes al cerrar
+            self.req_socket.setsockopt(zmq.LINGER, 0)
+            # HWM holgados para la ventana de pipelining
+            self.req_socket.setsockopt(zmq.SNDHWM, 10000)
+            self.req_socket.setsockopt(zmq.RCVHWM, 10000)
+            # Keepalive TCP para detectar antes una conexión caída con el GC
+            self.req_socket.setsockopt(zmq.TCP_KEEPALIVE, 1)
+            self.req_socket.setsockopt(zmq.TCP_KEEPALIVE_IDLE, 30)
+            # IMMEDIATE: no encolar en una conexión aún no establecida; el primer envío
+            # espera a que el GC acepte la conexión, sin pausa fija tras connect
+            self.req_socket.setsockopt(zmq.IMMEDIATE, 1)
+            self.req_socket.setsockopt(zmq.RECONNECT_IVL, 100)
             gc_address = f"tcp://{self.gc_host}:{self.gc_port}"
             self.req_socket.connect(gc_address)
-            logger.info(f"Conectado al Gestor de Carga en {gc_address}")
-            
-            # Pequeña pausa para asegurar la conexión
-            time.sleep(2)
+            logger.info("Conectado al Gestor de Carga en %s", gc_address)
+            if self.max_en_vuelo > 1:
+                logger.info("Pipelining activado: hasta %d solicitudes en vuelo", self.max_en_vuelo)
             
         except Exception as e:
-            logger.error(f"Error conectando al Gestor de Carga: {e}")
+            logger.error("Error conectando al Gestor de Carga: %s", e)
             raise
     
     def leer_solicitudes(self, archivo_solicitudes):
-        """Lee las solicitudes desde el archivo de texto"""
-        solicitudes = []
+        """Lee las solicitudes desde el archivo de texto
         
+        Es un generador: entrega cada solicitud en cuanto se parsea su línea, así el envío
+        empieza sin esperar a leer todo el archivo y la memoria no crece con su tamaño.
+        """
         try:
             if not os.path.exists(archivo_solicitudes):
-                logger.error(f"Archivo de solicitudes no encontrado: {archivo_solicitudes}")
-                return solicitudes
+                logger.error("Archivo de solicitudes no encontrado: %s", archivo_solicitudes)
+                return
             
-            with open(archivo_solicitudes, 'r', encoding='utf-8') as f:
+            leidas = 0
+            with open(archivo_solicitudes, 'r', encoding='utf-8', buffering=1 << 20) as f:
                 for numero_linea, linea in enumerate(f, 1):
                     linea = linea.strip()
                     if not linea or linea.startswith('#'):
@@ -86,41 +109,57 @@ class ProcesoSolicitante:
                                 search_criteria = {"titulo": parte.split(':', 1)[1]}
                                 break
                         
+                        # El dict es ya el mensaje que se envía al GC, sin campos locales
                         solicitud = {
                             "op": operacion,
                             "libro_id": libro_id,
                             "usuario_id": usuario_id,
-                            "sede": sede,
-                            "search_criteria": search_criteria,
-                            "linea": numero_linea
+                            "sede": sede
                         }
-                        solicitudes.append(solicitud)
+                        if search_criteria:
+                            solicitud["search_criteria"] = search_criteria
+                        leidas += 1
+                        yield solicitud
                     else:
-                        logger.warning(f"Línea {numero_linea} mal formateada: {linea}")
+                        logger.warning("Línea %d mal formateada: %s", numero_linea, linea)
             
-            logger.info(f"Leídas {len(solicitudes)} solicitudes desde {archivo_solicitudes}")
-            return solicitudes
+            logger.info("Leídas %d solicitudes desde %s", leidas, archivo_solicitudes)
             
         except Exception as e:
-            logger.error(f"Error leyendo archivo de solicitudes: {e}")
-            return solicitudes
+            logger.error("Error leyendo archivo de solicitudes: %s", e)
+    
+    def _registrar_respuesta(self, solicitud, respuesta_bytes, inicio_ms):
+        """Parsea la respuesta del GC, registra métricas si es préstamo y actualiza contadores"""
+        # orjson parsea los bytes sin decodificarlos antes
+        respuesta = orjson.loads(respuesta_bytes)
+        
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Respuesta recibida: %s", respuesta_bytes.decode())
+        
+        # Registrar métricas para préstamos
+        if solicitud["op"] == "PRESTAMO" and inicio_ms:
+            fin_ms = obtener_timestamp_ms()
+            tiempo_respuesta_ms = medir_tiempo_respuesta(inicio_ms, fin_ms)
+            libro_id = respuesta.get("libro_id") or solicitud.get("libro_id") or "N/A"
+            exito = respuesta.get("status") == "OK"
+            self.metricas.registrar_prestamo(tiempo_respuesta_ms, libro_id, exito)
+            logger.debug("Tiempo de respuesta: %.2f ms", tiempo_respuesta_ms)
+        
+        # Procesar respuesta
+        if respuesta.get("status") == "OK":
+            self.contador_exitosos += 1
+            logger.info("Solicitud procesada exitosamente")
+        else:
+            self.contador_errores += 1
+            logger.error("Error en solicitud: %s", respuesta.get('message', 'Error desconocido'))
+        
+        self.contador_solicitudes += 1
     
     def enviar_solicitud(self, solicitud):
         """Envía una solicitud al Gestor de Carga y registra métricas si es préstamo"""
         try:
-            # Crear mensaje JSON
-            mensaje = {
-                "op": solicitud["op"],
-                "libro_id": solicitud["libro_id"],
-                "usuario_id": solicitud["usuario_id"],
-                "sede": solicitud["sede"]
-            }
-            
-            # Agregar search_criteria si existe
-            if solicitud.get("search_criteria"):
-                mensaje["search_criteria"] = solicitud["search_criteria"]
-            
-            mensaje_json = json.dumps(mensaje, ensure_ascii=False)
+            # orjson serializa directamente a bytes UTF-8, sin pasar por str
+            mensaje_json = orjson.dumps(solicitud)
             
             # Medir tiempo de respuesta para préstamos
             inicio_ms = None
@@ -128,97 +167,155 @@ class ProcesoSolicitante:
                 inicio_ms = obtener_timestamp_ms()
             
             # Enviar solicitud
-            self.req_socket.send(mensaje_json.encode('utf-8'))
-            logger.info(f"Solicitud #{self.contador_solicitudes + 1} enviada: {mensaje_json}")
+            self.req_socket.send(mensaje_json, copy=False)
+            if logger.isEnabledFor(logging.INFO):
+                logger.info("Solicitud #%d enviada: %s", self.contador_solicitudes + 1, mensaje_json.decode())
             
             # Recibir respuesta
             respuesta_bytes = self.req_socket.recv()
-            respuesta_str = respuesta_bytes.decode('utf-8')
-            respuesta = json.loads(respuesta_str)
-            
-            logger.info(f"Respuesta recibida: {respuesta_str}")
-            
-            # Registrar métricas para préstamos
-            if solicitud["op"] == "PRESTAMO" and inicio_ms:
-                fin_ms = obtener_timestamp_ms()
-                tiempo_respuesta_ms = medir_tiempo_respuesta(inicio_ms, fin_ms)
-                libro_id = respuesta.get("libro_id") or solicitud.get("libro_id") or "N/A"
-                exito = respuesta.get("status") == "OK"
-                self.metricas.registrar_prestamo(tiempo_respuesta_ms, libro_id, exito)
-                logger.info(f"Tiempo de respuesta: {tiempo_respuesta_ms:.2f} ms")
-            
-            # Procesar respuesta
-            if respuesta.get("status") == "OK":
-                self.contador_exitosos += 1
-                logger.info(f"Solicitud procesada exitosamente")
-            else:
-                self.contador_errores += 1
-                logger.error(f"Error en solicitud: {respuesta.get('message', 'Error desconocido')}")
-            
-            self.contador_solicitudes += 1
+            self._registrar_respuesta(solicitud, respuesta_bytes, inicio_ms)
             return True
             
-        except json.JSONDecodeError as e:
-            logger.error(f"Error parseando respuesta JSON: {e}")
+        except orjson.JSONDecodeError as e:
+            logger.error("Error parseando respuesta JSON: %s", e)
             self.contador_errores += 1
             return False
         except Exception as e:
-            logger.error(f"Error enviando solicitud: {e}")
+            logger.error("Error enviando solicitud: %s", e)
             self.contador_errores += 1
             return False
     
-    def procesar_solicitudes(self, archivo_solicitudes):
-        """Procesa todas las solicitudes del archivo"""
+    def procesar_solicitudes(self, archivo_solicitudes, pausa_s: float = 0.0):
+        """Procesa todas las solicitudes del archivo
+        
+        Args:
+            archivo_solicitudes: Ruta al archivo de solicitudes
+            pausa_s: Pausa en segundos entre solicitudes en modo REQ/REP (0 = sin pausa)
+        """
         logger.info("Iniciando procesamiento de solicitudes...")
         
-        # Leer solicitudes
+        # Las solicitudes se leen a medida que se envían
         solicitudes = self.leer_solicitudes(archivo_solicitudes)
         
-        if not solicitudes:
-            logger.warning("No hay solicitudes para procesar")
+        if self.max_en_vuelo > 1:
+            procesadas = 0
+            try:
+                procesadas = self._procesar_en_pipeline(solicitudes)
+            except KeyboardInterrupt:
+                logger.info("Interrupción detectada, deteniendo procesamiento...")
+            if procesadas == 0:
+                logger.warning("No hay solicitudes para procesar")
+                return
+            self.mostrar_estadisticas()
             return
         
-        logger.info(f"Procesando {len(solicitudes)} solicitudes...")
-        
         # Procesar cada solicitud
+        procesadas = 0
         for i, solicitud in enumerate(solicitudes, 1):
+            procesadas = i
             try:
-                logger.info(f"Procesando solicitud {i}/{len(solicitudes)}: {solicitud['op']} - {solicitud['libro_id']} - {solicitud['usuario_id']}")
+                # Pausa entre solicitudes (simular carga de trabajo real); no antes de la primera
+                if pausa_s and i > 1:
+                    logger.info("Esperando %s segundos antes de la siguiente solicitud...", pausa_s)
+                    time.sleep(pausa_s)
+                
+                logger.debug("Procesando solicitud %d: %s - %s - %s", i, solicitud['op'], solicitud['libro_id'], solicitud['usuario_id'])
                 
                 # Enviar solicitud
                 exito = self.enviar_solicitud(solicitud)
                 
                 if exito:
-                    logger.info(f"Solicitud {i} completada")
+                    logger.debug("Solicitud %d completada", i)
                 else:
-                    logger.error(f"Solicitud {i} falló")
-                
-                # Pausa entre solicitudes (simular carga de trabajo real)
-                if i < len(solicitudes):  # No pausar después de la última solicitud
-                    logger.info("Esperando 1 segundo antes de la siguiente solicitud...")
-                    time.sleep(1)
+                    logger.error("Solicitud %d falló", i)
                 
             except KeyboardInterrupt:
                 logger.info("Interrupción detectada, deteniendo procesamiento...")
                 break
             except Exception as e:
-                logger.error(f"Error procesando solicitud {i}: {e}")
+                logger.error("Error procesando solicitud %d: %s", i, e)
                 self.contador_errores += 1
                 continue
         
+        if procesadas == 0:
+            logger.warning("No hay solicitudes para procesar")
+            return
+        
         # Mostrar estadísticas finales
         self.mostrar_estadisticas()
     
+    def _procesar_en_pipeline(self, solicitudes):
+        """Envía las solicitudes por DEALER manteniendo hasta max_en_vuelo sin respuesta
+        
+        Cada solicitud lleva un id en el sobre; el GC puede responder en otro orden
+        (modo multithread) y el id identifica a qué solicitud corresponde cada respuesta.
+        
+        Args:
+            solicitudes: Iterable de solicitudes (se consume a medida que hay hueco en la ventana)
+        
+        Returns:
+            Número de solicitudes enviadas
+        """
+        en_vuelo = {}  # id -> (solicitud, inicio_ms)
+        pendientes = iter(solicitudes)
+        agotadas = False
+        enviadas = 0
+        poller = zmq.Poller()
+        poller.register(self.req_socket, zmq.POLLIN)
+        
+        while not agotadas or en_vuelo:
+            # Llenar la ventana de solicitudes en vuelo
+            while not agotadas and len(en_vuelo) < self.max_en_vuelo:
+                solicitud = next(pendientes, None)
+                if solicitud is None:
+                    agotadas = True
+                    break
+                enviadas += 1
+                id_solicitud = b'%d' % enviadas
+                mensaje_json = orjson.dumps(solicitud)
+                inicio_ms = obtener_timestamp_ms() if solicitud["op"] == "PRESTAMO" else None
+                
+                self.req_socket.send_multipart([id_solicitud, b'', mensaje_json], copy=False)
+                if logger.isEnabledFor(logging.INFO):
+                    logger.info("Solicitud #%d enviada: %s", enviadas, mensaje_json.decode())
+                en_vuelo[id_solicitud] = (solicitud, inicio_ms)
+            
+            if not en_vuelo:
+                break
+            
+            if not poller.poll(self.timeout_respuesta_ms):
+                logger.error("Timeout esperando respuestas del GC: %d solicitudes sin respuesta", len(en_vuelo))
+                # Las solicitudes abandonadas se enviaron: cuentan como enviadas y con error
+                self.contador_solicitudes += len(en_vuelo)
+                self.contador_errores += len(en_vuelo)
+                break
+            
+            # Respuesta: [id, b'', payload]
+            frames = self.req_socket.recv_multipart()
+            pendiente = en_vuelo.pop(frames[0], None)
+            if pendiente is None:
+                logger.warning("Respuesta con id desconocido: %r", frames[0])
+                continue
+            
+            solicitud, inicio_ms = pendiente
+            try:
+                self._registrar_respuesta(solicitud, frames[-1], inicio_ms)
+            except orjson.JSONDecodeError as e:
+                logger.error("Error parseando respuesta JSON: %s", e)
+                self.contador_errores += 1
+        
+        return enviadas
+    
     def mostrar_estadisticas(self):
         """Muestra estadísticas del procesamiento"""
         logger.info("===== ESTADÍSTICAS FINALES =====")
-        logger.info(f"Total de solicitudes enviadas: {self.contador_solicitudes}")
-        logger.info(f"Solicitudes exitosas: {self.contador_exitosos}")
-        logger.info(f"Solicitudes con error: {self.contador_errores}")
+        logger.info("Total de solicitudes enviadas: %d", self.contador_solicitudes)
+        logger.info("Solicitudes exitosas: %d", self.contador_exitosos)
+        logger.info("Solicitudes con error: %d", self.contador_errores)
         
         if self.contador_solicitudes > 0:
             porcentaje_exito = (self.contador_exitosos / self.contador_solicitudes) * 100
-            logger.info(f"Porcentaje de éxito: {porcentaje_exito:.1f}%")
+            logger.info("Porcentaje de éxito: %.1f%%", porcentaje_exito)
         
         logger.info("================================")
         
@@ -234,17 +331,18 @@ class ProcesoSolicitante:
             self.conectar_gestor_carga()
             
             # Procesar solicitudes
-            self.procesar_solicitudes(archivo_solicitudes)
+            self.procesar_solicitudes(archivo_solicitudes, self.pausa_s)
             
         except KeyboardInterrupt:
             logger.info("Deteniendo Proceso Solicitante...")
         except Exception as e:
-            logger.error(f"Error fatal en Proceso Solicitante: {e}")
+            logger.error("Error fatal en Proceso Solicitante: %s", e)
         finally:
             self.detener()
     
     def detener(self):
         """Detiene el Proceso Solicitante"""
+        self.metricas.cerrar()
         if self.req_socket:
             self.req_socket.close()
         if self.context:
@@ -254,6 +352,8 @@ class ProcesoSolicitante:
 
 def main():
     """Función principal"""
+    # LOG_LEVEL=DEBUG muestra también cada paso de cada solicitud
+    configurar_logging('PS', os.getenv('LOG_LEVEL', 'INFO'))
     ps = ProcesoSolicitante()
     ps.iniciar()
 
@@ -5,23 +5,53 @@ Prueba Rápida del Sistema Distribuido
 Prueba las funcionalidades básicas sin usar Docker
 """
 
-import json
+import orjson
 import os
 import sys
-import time
-from datetime import datetime, timedelta
+from collections import defaultdict
+from datetime import date, datetime, timedelta
 
 # Agregar el directorio actual al path para importar módulos
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
-def probar_carga_datos():
+def cargar_datos():
+    """Lee y parsea data/libros.json una sola vez para todas las pruebas"""
+    with open('data/libros.json', 'rb') as f:
+        return orjson.loads(f.read())
+
+def construir_indices(datos):
+    """Indexa una vez los ejemplares por estado y por (libro_id, estado), los libros por libro_id
+    y los ejemplares prestados de cada libro por (libro_id, usuario, sede)"""
+    por_estado = defaultdict(list)
+    por_libro_estado = defaultdict(list)
+    for ejemplar in datos.get('ejemplares', []):
+        estado = ejemplar.get('estado')
+        por_estado[estado].append(ejemplar)
+        por_libro_estado[(ejemplar.get('libro_id'), estado)].append(ejemplar)
+    
+    libro_por_id = {}
+    prestado_por_usuario_sede = {}
+    for libro in datos.get('libros', []):
+        libro_id = libro.get('libro_id')
+        libro_por_id[libro_id] = libro
+        for ejemplar in libro.get('ejemplares', []):
+            if ejemplar.get('estado') == 'prestado':
+                # Se conserva el primero, como haría un recorrido en orden
+                clave = (libro_id, ejemplar.get('usuario_prestamo'), ejemplar.get('sede'))
+                prestado_por_usuario_sede.setdefault(clave, ejemplar)
+    
+    return {
+        "por_estado": por_estado,
+        "por_libro_estado": por_libro_estado,
+        "libro_por_id": libro_por_id,
+        "prestado_por_usuario_sede": prestado_por_usuario_sede
+    }
+
+def probar_carga_datos(datos, indices):
     """Prueba que los datos se cargan correctamente"""
     print("🔍 Probando carga de datos...")
     
     try:
-        with open('data/libros.json', 'r', encoding='utf-8') as f:
-            datos = json.load(f)
-        
         libros = datos.get('libros', [])
         ejemplares = datos.get('ejemplares', [])
         
@@ -29,7 +59,7 @@ def probar_carga_datos():
         print(f"  ✅ Cargados {len(ejemplares)} ejemplares")
         
         # Verificar algunos ejemplares prestados
-        prestados = [e for e in ejemplares if e.get('estado') == 'prestado']
+        prestados = indices["por_estado"]['prestado']
         print(f"  ✅ {len(prestados)} ejemplares prestados")
         
         return True
@@ -38,16 +68,12 @@ def probar_carga_datos():
         print(f"  ❌ Error cargando datos: {e}")
         return False
 
-def probar_busqueda_ejemplar():
+def probar_busqueda_ejemplar(datos, indices):
     """Prueba la búsqueda de ejemplares"""
     print("🔍 Probando búsqueda de ejemplares...")
     
     try:
-        with open('data/libros.json', 'r', encoding='utf-8') as f:
-            datos = json.load(f)
-        
         libros = datos.get('libros', [])
-        ejemplares = datos.get('ejemplares', [])
         
         # Buscar un libro con ejemplares prestados
         libro_con_prestamos = None
@@ -64,11 +90,7 @@ def probar_busqueda_ejemplar():
         print(f"  ✅ Probando con libro: {libro_id}")
         
         # Buscar ejemplares prestados de este libro
-        ejemplares_prestados = []
-        for ejemplar in ejemplares:
-            if (ejemplar.get('libro_id') == libro_id and 
-                ejemplar.get('estado') == 'prestado'):
-                ejemplares_prestados.append(ejemplar)
+        ejemplares_prestados = indices["por_libro_estado"][(libro_id, 'prestado')]
         
         print(f"  ✅ Encontrados {len(ejemplares_prestados)} ejemplares prestados")
         
@@ -85,23 +107,13 @@ def probar_busqueda_ejemplar():
         print(f"  ❌ Error en búsqueda: {e}")
         return False
 
-def probar_simulacion_devolucion():
+def probar_simulacion_devolucion(datos, indices):
     """Simula una devolución para probar la lógica"""
     print("🔍 Probando simulación de devolución...")
     
     try:
-        with open('data/libros.json', 'r', encoding='utf-8') as f:
-            datos = json.load(f)
-        
-        libros = datos.get('libros', [])
-        ejemplares = datos.get('ejemplares', [])
-        
         # Buscar un ejemplar prestado
-        ejemplar_prestado = None
-        for ejemplar in ejemplares:
-            if ejemplar.get('estado') == 'prestado':
-                ejemplar_prestado = ejemplar
-                break
+        ejemplar_prestado = next(iter(indices["por_estado"]['prestado']), None)
         
         if not ejemplar_prestado:
             print("  ⚠️  No se encontraron ejemplares prestados")
@@ -117,32 +129,27 @@ def probar_simulacion_devolucion():
         libro_encontrado = False
         ejemplar_devuelto = False
         
-        for libro in libros:
-            if libro.get('libro_id') == libro_id:
-                for ejemplar in libro.get('ejemplares', []):
-                    if (ejemplar.get('estado') == 'prestado' and 
-                        ejemplar.get('usuario_prestamo') == usuario_id and
-                        ejemplar.get('sede') == sede):
-                        
-                        # Simular cambio de estado
-                        ejemplar['estado'] = 'disponible'
-                        ejemplar['fecha_devolucion'] = None
-                        ejemplar['usuario_prestamo'] = None
-                        ejemplar['sede'] = None
-                        
-                        # Actualizar contadores
-                        libro['ejemplares_disponibles'] = libro.get('ejemplares_disponibles', 0) + 1
-                        libro['ejemplares_prestados'] = libro.get('ejemplares_prestados', 0) - 1
-                        
-                        print(f"  ✅ Ejemplar {ejemplar['ejemplar_id']} marcado como disponible")
-                        print(f"  ✅ Disponibles: {libro['ejemplares_disponibles']}, Prestados: {libro['ejemplares_prestados']}")
-                        
-                        ejemplar_devuelto = True
-                        break
+        libro = indices["libro_por_id"].get(libro_id)
+        ejemplar = indices["prestado_por_usuario_sede"].get((libro_id, usuario_id, sede))
+        if libro is not None:
+            libro_encontrado = True
+            if ejemplar is not None:
+                # Simular cambio de estado sobre copias: los datos se comparten entre pruebas
+                ejemplar = dict(ejemplar)
+                libro = dict(libro)
+                ejemplar['estado'] = 'disponible'
+                ejemplar['fecha_devolucion'] = None
+                ejemplar['usuario_prestamo'] = None
+                ejemplar['sede'] = None
+                
+                # Actualizar contadores
+                libro['ejemplares_disponibles'] = libro.get('ejemplares_disponibles', 0) + 1
+                libro['ejemplares_prestados'] = libro.get('ejemplares_prestados', 0) - 1
                 
-                if ejemplar_devuelto:
-                    libro_encontrado = True
-                    break
+                print(f"  ✅ Ejemplar {ejemplar['ejemplar_id']} marcado como disponible")
+                print(f"  ✅ Disponibles: {libro['ejemplares_disponibles']}, Prestados: {libro['ejemplares_prestados']}")
+                
+                ejemplar_devuelto = True
         
         if libro_encontrado and ejemplar_devuelto:
             print("  ✅ Simulación de devolución exitosa")
@@ -155,23 +162,13 @@ def probar_simulacion_devolucion():
         print(f"  ❌ Error en simulación: {e}")
         return False
 
-def probar_simulacion_renovacion():
+def probar_simulacion_renovacion(datos, indices):
     """Simula una renovación para probar la lógica"""
     print("🔍 Probando simulación de renovación...")
     
     try:
-        with open('data/libros.json', 'r', encoding='utf-8') as f:
-            datos = json.load(f)
-        
-        libros = datos.get('libros', [])
-        ejemplares = datos.get('ejemplares', [])
-        
         # Buscar un ejemplar prestado
-        ejemplar_prestado = None
-        for ejemplar in ejemplares:
-            if ejemplar.get('estado') == 'prestado':
-                ejemplar_prestado = ejemplar
-                break
+        ejemplar_prestado = next(iter(indices["por_estado"]['prestado']), None)
         
         if not ejemplar_prestado:
             print("  ⚠️  No se encontraron ejemplares prestados")
@@ -183,7 +180,8 @@ def probar_simulacion_renovacion():
         fecha_actual = ejemplar_prestado.get('fecha_devolucion')
         
         # Calcular nueva fecha (+7 días)
-        nueva_fecha = (datetime.strptime(fecha_actual, '%Y-%m-%d') + timedelta(days=7)).strftime('%Y-%m-%d')
+        # date.fromisoformat/isoformat son la ruta en C para fechas YYYY-MM-DD (strptime es Python puro)
+        nueva_fecha = (date.fromisoformat(fecha_actual) + timedelta(days=7)).isoformat()
         
         print(f"  ✅ Simulando renovación: {libro_id} - {usuario_id} - {sede}")
         print(f"  ✅ Fecha actual: {fecha_actual} → Nueva fecha: {nueva_fecha}")
@@ -192,25 +190,19 @@ def probar_simulacion_renovacion():
         libro_encontrado = False
         ejemplar_renovado = False
         
-        for libro in libros:
-            if libro.get('libro_id') == libro_id:
-                for ejemplar in libro.get('ejemplares', []):
-                    if (ejemplar.get('estado') == 'prestado' and 
-                        ejemplar.get('usuario_prestamo') == usuario_id and
-                        ejemplar.get('sede') == sede):
-                        
-                        # Simular cambio de fecha
-                        ejemplar['fecha_devolucion'] = nueva_fecha
-                        
-                        print(f"  ✅ Ejemplar {ejemplar['ejemplar_id']} renovado")
-                        print(f"  ✅ Nueva fecha de devolución: {nueva_fecha}")
-                        
-                        ejemplar_renovado = True
-                        break
+        libro = indices["libro_por_id"].get(libro_id)
+        ejemplar = indices["prestado_por_usuario_sede"].get((libro_id, usuario_id, sede))
+        if libro is not None:
+            libro_encontrado = True
+            if ejemplar is not None:
+                # Simular cambio de fecha sobre una copia: los datos se comparten entre pruebas
+                ejemplar = dict(ejemplar)
+                ejemplar['fecha_devolucion'] = nueva_fecha
+                
+                print(f"  ✅ Ejemplar {ejemplar['ejemplar_id']} renovado")
+                print(f"  ✅ Nueva fecha de devolución: {nueva_fecha}")
                 
-                if ejemplar_renovado:
-                    libro_encontrado = True
-                    break
+                ejemplar_renovado = True
         
         if libro_encontrado and ejemplar_renovado:
             print("  ✅ Simulación de renovación exitosa")
@@ -233,6 +225,14 @@ def main():
     # Cambiar al directorio del sistema
     os.chdir('/Users/alejoparrado/Desktop/proyecto_distribuidos/sistema_distribuido')
     
+    # Cargar los datos e índices una sola vez
+    try:
+        datos = cargar_datos()
+        indices = construir_indices(datos)
+    except Exception as e:
+        print(f"❌ Error cargando data/libros.json: {e}")
+        return
+    
     # Pruebas
     pruebas = [
         ("Carga de datos", probar_carga_datos),
@@ -244,9 +244,8 @@ def main():
     todas_pasaron = True
     for nombre, funcion in pruebas:
         print(f"\n{nombre}:")
-        if not funcion():
+        if not funcion(datos, indices):
             todas_pasaron = False
-        time.sleep(0.5)  # Pausa entre pruebas
     
     # Resultado final
     print(f"\n{'='*60}")
@@ -5,25 +5,73 @@ Valida comunicación REQ/REP, PUB/SUB y actualización de base de datos
 """
 
 import pytest
-import time
 import json
 import os
 from datetime import datetime, timedelta
 from tests.test_utils import TestUtils, SubscriberTester
 
+def _load_indexed(path):
+    """
+    Lee libros.json una vez y lo indexa por libro_id
+    
+    Returns:
+        Tuple[mtime_ns, {libro_id: libro}]; mtime_ns es 0 si el archivo no existe
+    """
+    try:
+        mtime_ns = os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        mtime_ns = 0
+    datos = TestUtils.read_json(path)
+    # La base de datos guarda los libros bajo la clave 'libros'; se acepta también una lista plana
+    libros = datos.get('libros', []) if isinstance(datos, dict) else datos
+    return mtime_ns, {l.get('libro_id'): l for l in libros}
+
+def _esperar_libro(path, base_mtime, index, libro_id, predicate, timeout=3.0):
+    """
+    Espera hasta que el libro cumpla predicate, releyendo el archivo solo cuando cambia su mtime
+    
+    Returns:
+        El libro indexado tras la última lectura (vacío si no existe)
+    """
+    estado = {"mtime": base_mtime, "libro": index.get(libro_id, {})}
+    
+    def _reload_if_changed():
+        try:
+            mtime_ns = os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            return estado["libro"]
+        if mtime_ns != estado["mtime"]:
+            estado["mtime"], nuevo_index = _load_indexed(path)
+            estado["libro"] = nuevo_index.get(libro_id, {})
+        return estado["libro"]
+    
+    TestUtils.wait_until(lambda: predicate(_reload_if_changed()), timeout=timeout)
+    return estado["libro"]
+
 class TestEndToEnd:
     """Test end-to-end del sistema distribuido"""
     
+    gc_pub_endpoint = "tcp://gc:5002"
+    
+    @pytest.fixture(scope="class", autouse=True)
+    def subscriber_compartido(self, request):
+        """
+        Un solo SUB para toda la clase, suscrito a devolucion y renovacion: la conexión
+        y la espera del slow joiner se pagan una vez y no en cada test
+        """
+        subscriber = SubscriberTester(request.cls.gc_pub_endpoint)
+        subscriber.conectar(["devolucion", "renovacion"])
+        subscriber.iniciar_escucha()
+        request.cls.subscriber = subscriber
+        yield subscriber
+        subscriber.detener()
+    
     def setup_method(self):
         """Configuración antes de cada test"""
         self.gc_endpoint = "tcp://gc:5001"
-        self.gc_pub_endpoint = "tcp://gc:5002"
         self.libros_path = "data/libros.json"
         self.logs_path = "logs/test_end_to_end.txt"
         
-        # Crear directorio de logs si no existe
-        os.makedirs("logs", exist_ok=True)
-        
         # Resultados del test
         self.resultados = {
             "test_name": "test_end_to_end",
@@ -41,22 +89,19 @@ class TestEndToEnd:
         # 1. Crear snapshot inicial
         snapshot_path = "logs/libros_before_devolucion.json"
         TestUtils.crear_snapshot_libros(self.libros_path, snapshot_path)
-        libros_inicial = TestUtils.read_json(self.libros_path)
+        base_mtime, index = _load_indexed(self.libros_path)
         
         # Usar un libro diferente para evitar conflictos con pruebas anteriores
         libro_id = "L003"  # Cambiar a L003 que tiene menos modificaciones
-        ejemplares_iniciales = next(
-            (l.get('ejemplares_disponibles', 0) for l in libros_inicial if l.get('libro_id') == libro_id), 0
-        )
+        ejemplares_iniciales = index.get(libro_id, {}).get('ejemplares_disponibles', 0)
         print(f"Estado inicial - Libro {libro_id}: {ejemplares_iniciales} ejemplares")
         
-        # 2. Configurar subscriber para eventos de devolución
-        subscriber = SubscriberTester(self.gc_pub_endpoint)
-        subscriber.conectar(["devolucion"])
-        subscriber.iniciar_escucha()
+        # 2. Eventos de devolución: el subscriber es compartido por la clase, así que
+        # solo cuentan los que lleguen después de este punto
+        eventos_previos = len(self.subscriber.obtener_eventos("DEVOLUCION"))
         
-        # Esperar slow joiner
-        TestUtils.esperar_slow_joiner()
+        def eventos_propios():
+            return self.subscriber.obtener_eventos("DEVOLUCION")[eventos_previos:]
         
         # 3. Enviar solicitud de devolución
         usuario_id = "U_TEST_DEV"
@@ -79,9 +124,10 @@ class TestEndToEnd:
         
         # 5. Esperar evento PUB/SUB
         print("Esperando evento de devolución...")
-        time.sleep(2)  # Dar tiempo para procesamiento asíncrono
+        # Retorna en cuanto llega el evento (procesamiento asíncrono)
+        TestUtils.wait_until(lambda: len(eventos_propios()) > 0, timeout=3)
         
-        eventos_devolucion = subscriber.obtener_eventos("DEVOLUCION")
+        eventos_devolucion = eventos_propios()
         assert len(eventos_devolucion) > 0, "No se recibió evento de devolución"
         
         evento = eventos_devolucion[0]
@@ -93,48 +139,23 @@ class TestEndToEnd:
         # 6. Validar actualización de base de datos
         print("Esperando actualización de base de datos...")
         
-        def validar_incremento_ejemplares(libros_actual):
-            for libro in libros_actual:
-                if libro.get('libro_id') == libro_id:
-                    ejemplares_actuales = libro.get('ejemplares_disponibles', 0)
-                    print(f"Estado actual - Libro {libro_id}: {ejemplares_actuales} ejemplares (inicial: {ejemplares_iniciales})")
-                    return ejemplares_actuales > ejemplares_iniciales
-            return False
+        def validar_incremento_ejemplares(libro):
+            return libro.get('ejemplares_disponibles', 0) > ejemplares_iniciales
         
-        # Esperar un momento para que el actor procese
-        time.sleep(3)
+        # Esperar a que el actor procese: solo se relee libros.json cuando cambia su mtime
+        libro_final = _esperar_libro(self.libros_path, base_mtime, index, libro_id,
+                                     validar_incremento_ejemplares)
+        ejemplares_finales = libro_final.get('ejemplares_disponibles', 0)
+        print(f"Estado final - Libro {libro_id}: {ejemplares_finales} ejemplares (inicial: {ejemplares_iniciales})")
         
-        # Verificar cambio directamente
-        libros_final = TestUtils.read_json(self.libros_path)
-        cambio_detectado = False
-        
-        for libro in libros_final:
-            if libro.get('libro_id') == libro_id:
-                ejemplares_actuales = libro.get('ejemplares_disponibles', 0)
-                print(f"Estado final - Libro {libro_id}: {ejemplares_actuales} ejemplares (inicial: {ejemplares_iniciales})")
-                if ejemplares_actuales > ejemplares_iniciales:
-                    cambio_detectado = True
-                    break
-        
-        assert cambio_detectado, f"No se detectó incremento en ejemplares disponibles. Inicial: {ejemplares_iniciales}, Final: {ejemplares_actuales}"
+        assert validar_incremento_ejemplares(libro_final), f"No se detectó incremento en ejemplares disponibles. Inicial: {ejemplares_iniciales}, Final: {ejemplares_finales}"
         
         # Verificar cambio específico
-        libros_final = TestUtils.read_json(self.libros_path)
-        for libro in libros_final:
-            if libro.get('libro_id') == libro_id:
-                ejemplares_finales = libro.get('ejemplares_disponibles', 0)
-                ejemplares_iniciales = next(
-                    (l.get('ejemplares_disponibles', 0) for l in libros_inicial if l.get('libro_id') == libro_id), 0
-                )
-                assert ejemplares_finales == ejemplares_iniciales + 1, \
-                    f"Ejemplares no incrementaron correctamente: {ejemplares_iniciales} -> {ejemplares_finales}"
-                break
+        assert ejemplares_finales == ejemplares_iniciales + 1, \
+            f"Ejemplares no incrementaron correctamente: {ejemplares_iniciales} -> {ejemplares_finales}"
         
         print("Base de datos actualizada correctamente")
         
-        # Limpiar
-        subscriber.detener()
-        
         # Actualizar resultados
         self.resultados["operaciones_procesadas"] += 1
         self.resultados["tiempo_ack_promedio"] = ack_ms
@@ -146,22 +167,19 @@ class TestEndToEnd:
         # 1. Crear snapshot inicial
         snapshot_path = "logs/libros_before_renovacion.json"
         TestUtils.crear_snapshot_libros(self.libros_path, snapshot_path)
-        libros_inicial = TestUtils.read_json(self.libros_path)
+        base_mtime, index = _load_indexed(self.libros_path)
         
         # Usar un libro diferente para evitar conflictos con pruebas anteriores
         libro_id = "L002"  # Cambiar a L002 para renovación
-        fecha_inicial = next(
-            (l.get('fecha_devolucion', '') for l in libros_inicial if l.get('libro_id') == libro_id), ''
-        )
+        fecha_inicial = index.get(libro_id, {}).get('fecha_devolucion', '')
         print(f"Estado inicial - Libro {libro_id}: fecha {fecha_inicial}")
         
-        # 2. Configurar subscriber para eventos de renovación
-        subscriber = SubscriberTester(self.gc_pub_endpoint)
-        subscriber.conectar(["renovacion"])
-        subscriber.iniciar_escucha()
+        # 2. Eventos de renovación: el subscriber es compartido por la clase, así que
+        # solo cuentan los que lleguen después de este punto
+        eventos_previos = len(self.subscriber.obtener_eventos("RENOVACION"))
         
-        # Esperar slow joiner
-        TestUtils.esperar_slow_joiner()
+        def eventos_propios():
+            return self.subscriber.obtener_eventos("RENOVACION")[eventos_previos:]
         
         # 3. Enviar solicitud de renovación
         usuario_id = "U_TEST_REN"
@@ -184,9 +202,10 @@ class TestEndToEnd:
         
         # 5. Esperar evento PUB/SUB
         print("Esperando evento de renovación...")
-        time.sleep(2)  # Dar tiempo para procesamiento asíncrono
+        # Retorna en cuanto llega el evento (procesamiento asíncrono)
+        TestUtils.wait_until(lambda: len(eventos_propios()) > 0, timeout=3)
         
-        eventos_renovacion = subscriber.obtener_eventos("RENOVACION")
+        eventos_renovacion = eventos_propios()
         assert len(eventos_renovacion) > 0, "No se recibió evento de renovación"
         
         evento = eventos_renovacion[0]
@@ -203,45 +222,20 @@ class TestEndToEnd:
         # 6. Validar actualización de base de datos
         print("Esperando actualización de fecha de devolución...")
         
-        def validar_fecha_actualizada(libros_actual):
-            for libro in libros_actual:
-                if libro.get('libro_id') == libro_id:
-                    fecha_actual = libro.get('fecha_devolucion', '')
-                    print(f"Estado actual - Libro {libro_id}: fecha {fecha_actual} (inicial: {fecha_inicial}, esperada: {nueva_fecha})")
-                    return fecha_actual != fecha_inicial and fecha_actual == nueva_fecha
-            return False
+        def validar_fecha_actualizada(libro):
+            # La fecha actual debe coincidir con la fecha esperada del evento
+            return libro.get('fecha_devolucion', '') == nueva_fecha
         
-        # Esperar un momento para que el actor procese
-        time.sleep(3)
+        # Esperar a que el actor procese: solo se relee libros.json cuando cambia su mtime
+        libro_final = _esperar_libro(self.libros_path, base_mtime, index, libro_id,
+                                     validar_fecha_actualizada)
+        fecha_final = libro_final.get('fecha_devolucion', '')
+        print(f"Estado final - Libro {libro_id}: fecha {fecha_final} (inicial: {fecha_inicial}, esperada: {nueva_fecha})")
         
-        # Verificar cambio directamente
-        libros_final = TestUtils.read_json(self.libros_path)
-        cambio_detectado = False
-        
-        for libro in libros_final:
-            if libro.get('libro_id') == libro_id:
-                fecha_actual = libro.get('fecha_devolucion', '')
-                print(f"Estado final - Libro {libro_id}: fecha {fecha_actual} (inicial: {fecha_inicial}, esperada: {nueva_fecha})")
-                # Verificar que la fecha actual coincide con la fecha esperada del evento
-                if fecha_actual == nueva_fecha:
-                    cambio_detectado = True
-                    break
-        
-        assert cambio_detectado, f"No se detectó actualización de fecha de devolución. Final: {fecha_actual}, Esperada: {nueva_fecha}"
-        
-        # Verificar cambio específico
-        libros_final = TestUtils.read_json(self.libros_path)
-        for libro in libros_final:
-            if libro.get('libro_id') == libro_id:
-                fecha_final = libro.get('fecha_devolucion', '')
-                assert fecha_final == nueva_fecha, f"Fecha no actualizada correctamente: {fecha_final} != {nueva_fecha}"
-                break
+        assert validar_fecha_actualizada(libro_final), f"No se detectó actualización de fecha de devolución. Final: {fecha_final}, Esperada: {nueva_fecha}"
         
         print("Fecha de devolución actualizada correctamente")
         
-        # Limpiar
-        subscriber.detener()
-        
         # Actualizar resultados
         self.resultados["operaciones_procesadas"] += 1
         self.resultados["tiempo_ack_promedio"] = (self.resultados["tiempo_ack_promedio"] + ack_ms) / 2
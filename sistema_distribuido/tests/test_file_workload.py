@@ -8,10 +8,75 @@ import pytest
 import time
 import json
 import os
+import re
+import mmap
+import select
 import subprocess
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from typing import Optional
 from tests.test_utils import TestUtils
 
+# Primera palabra de cada línea no vacía que no empieza con '#' (la operación de la solicitud)
+OPERACION_PAT = re.compile(rb'(?m)^(?!#)[^\S\n]*(\S+)')
+
+# Marcadores de los logs del PS y del GC: una sola pasada por log cuenta todos (m.lastgroup)
+PS_PAT = re.compile(
+    rb'(?P<enviadas>Solicitud #)'
+    rb'|(?P<exitosas>Solicitud procesada exitosamente)'
+    rb'|(?P<error>Error en solicitud)'
+)
+GC_PAT = re.compile((
+    r'(?P<operaciones>Operación #)'
+    r'|(?P<devolucion>Topic: devolucion)'
+    r'|(?P<renovacion>Topic: renovacion)'
+).encode('utf-8'))
+
+def _campos_por_libro(datos) -> dict:
+    """Indexa por libro_id los campos que cambian con devoluciones y renovaciones"""
+    # La base de datos guarda los libros bajo la clave 'libros'; se acepta también una lista plana
+    libros = datos.get('libros', []) if isinstance(datos, dict) else datos
+    return {
+        l.get('libro_id'): (l.get('ejemplares_disponibles'), l.get('fecha_devolucion'))
+        for l in libros
+    }
+
+def _contenedor_corriendo(nombre: str) -> bool:
+    """Consulta con docker inspect si el contenedor está en ejecución"""
+    result = subprocess.run(
+        ["docker", "inspect", "-f", "{{.State.Running}}", nombre],
+        capture_output=True, text=True, timeout=10
+    )
+    return result.stdout.strip() == "true"
+
+def _inicio_contenedor(nombre: str) -> Optional[str]:
+    """Instante (RFC 3339) en que arrancó la ejecución actual del contenedor, o None"""
+    try:
+        result = subprocess.run(
+            ["docker", "inspect", "-f", "{{.State.StartedAt}}", nombre],
+            capture_output=True, text=True, timeout=10
+        )
+        return result.stdout.strip() or None
+    except Exception as e:
+        print(f"WARNING: Error consultando inicio de {nombre}: {e}")
+        return None
+
+def _docker_logs(nombre: str, since: Optional[str] = None) -> bytes:
+    """Devuelve los logs del contenedor en bytes, sin decodificar (el logging de Python escribe en stderr)"""
+    comando = ["docker", "logs", nombre]
+    if since:
+        comando[2:2] = ["--since", since]
+    try:
+        result = subprocess.run(
+            comando,
+            stdout=subprocess.PIPE, stderr=subprocess.STDOUT, timeout=10
+        )
+        return result.stdout
+    except Exception as e:
+        print(f"WARNING: Error obteniendo logs de {nombre}: {e}")
+        return b""
+
 class TestFileWorkload:
     """Test de workload con archivo de solicitudes"""
     
@@ -21,9 +86,6 @@ class TestFileWorkload:
         self.solicitudes_path = "data/solicitudes.txt"
         self.logs_path = "logs/test_file_workload.txt"
         
-        # Crear directorio de logs si no existe
-        os.makedirs("logs", exist_ok=True)
-        
         # Resultados del test
         self.resultados = {
             "test_name": "test_file_workload",
@@ -44,11 +106,7 @@ class TestFileWorkload:
         # 1. Verificar que PS está corriendo
         print("Verificando que PS está corriendo...")
         try:
-            result = subprocess.run(
-                ["docker", "ps", "--filter", "name=ps", "--format", "{{.Names}}"],
-                capture_output=True, text=True, timeout=10
-            )
-            ps_running = "ps" in result.stdout
+            ps_running = _contenedor_corriendo("ps")
         except Exception as e:
             print(f"WARNING: Error verificando PS: {e}")
             ps_running = False
@@ -70,72 +128,87 @@ class TestFileWorkload:
         if not os.path.exists(self.solicitudes_path):
             pytest.skip(f"Archivo de solicitudes no encontrado: {self.solicitudes_path}")
         
-        with open(self.solicitudes_path, 'r', encoding='utf-8') as f:
-            solicitudes = [line.strip() for line in f if line.strip() and not line.startswith('#')]
+        # Una sola pasada sobre los bytes del archivo cuenta las solicitudes por operación
+        operaciones = Counter()
+        if os.path.getsize(self.solicitudes_path) > 0:
+            with open(self.solicitudes_path, 'rb') as f, \
+                    mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                operaciones.update(OPERACION_PAT.findall(mm))
         
-        self.resultados["solicitudes_en_archivo"] = len(solicitudes)
-        print(f"Solicitudes en archivo: {len(solicitudes)}")
+        total_solicitudes = sum(operaciones.values())
+        total_renovaciones = operaciones[b'RENOVACION']
+        total_devoluciones = operaciones[b'DEVOLUCION']
         
-        # Contar por tipo
-        renovaciones = [s for s in solicitudes if s.startswith('RENOVACION')]
-        devoluciones = [s for s in solicitudes if s.startswith('DEVOLUCION')]
+        self.resultados["solicitudes_en_archivo"] = total_solicitudes
+        print(f"Solicitudes en archivo: {total_solicitudes}")
         
-        print(f"   - Renovaciones: {len(renovaciones)}")
-        print(f"   - Devoluciones: {len(devoluciones)}")
+        print(f"   - Renovaciones: {total_renovaciones}")
+        print(f"   - Devoluciones: {total_devoluciones}")
         
         # 3. Crear snapshot inicial de libros
         snapshot_path = "logs/libros_before_workload.json"
         TestUtils.crear_snapshot_libros(self.libros_path, snapshot_path)
-        libros_inicial = TestUtils.read_json(self.libros_path)
+        campos_inicial = _campos_por_libro(TestUtils.read_json(self.libros_path))
         
         print("Snapshot inicial creado")
         
         # 4. Monitorear logs del PS para verificar procesamiento
         print("Monitoreando procesamiento del PS...")
         
-        # Esperar a que PS termine de procesar (timeout de 30 segundos)
+        # Esperar a que PS termine de procesar (timeout de 30 segundos): un único
+        # stream de 'docker events' avisa cuando el contenedor muere, sin sondear 'docker ps'
         timeout = 30
-        start_time = time.time()
         ps_completed = False
+        eventos = None
         
-        while time.time() - start_time < timeout:
-            try:
-                # Verificar si PS terminó
-                result = subprocess.run(
-                    ["docker", "ps", "--filter", "name=ps", "--format", "{{.Status}}"],
-                    capture_output=True, text=True, timeout=5
+        try:
+            # El instante se toma antes de consultar el estado y se pasa como --since: Popen
+            # vuelve antes de que el CLI se suscriba al daemon, y así docker reproduce un 'die'
+            # ocurrido entre la consulta y la suscripción en lugar de perderlo.
+            # Con --until el propio docker cierra el stream al vencer el plazo aunque el test se
+            # interrumpa. Ambos van como timestamp Unix absoluto: una duración ("30s") se
+            # interpreta como "hace 30 s" y el stream terminaría en el acto
+            desde = time.time()
+            deadline = str(int(desde) + timeout)
+            if not _contenedor_corriendo("ps"):
+                ps_completed = True
+            else:
+                eventos = subprocess.Popen(
+                    ["docker", "events", "--since", f"{desde:.6f}", "--until", deadline,
+                     "--filter", "container=ps", "--filter", "event=die",
+                     "--format", "{{.Status}}"],
+                    stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True
                 )
-                
-                if "ps" not in result.stdout or "Exited" in result.stdout:
-                    ps_completed = True
-                    print("PS completó el procesamiento")
-                    break
-                
-                time.sleep(1)
-                
-            except Exception as e:
-                print(f"WARNING: Error monitoreando PS: {e}")
-                break
+                listos, _, _ = select.select([eventos.stdout], [], [], timeout)
+                ps_completed = bool(listos) and bool(eventos.stdout.readline())
+            if ps_completed:
+                print("PS completó el procesamiento")
+        except Exception as e:
+            print(f"WARNING: Error monitoreando PS: {e}")
+        finally:
+            if eventos is not None:
+                eventos.kill()
+                eventos.wait()
         
         if not ps_completed:
             print(f"WARNING: PS no completó en {timeout} segundos, continuando...")
         
-        # 5. Analizar logs del PS
+        # 5. Analizar logs del PS (los logs del PS y del GC se piden en paralelo)
+        # Solo se piden los logs desde que arrancó esta ejecución del PS: menos bytes desde
+        # dockerd y sin contar operaciones de corridas anteriores
         print("Analizando logs del PS...")
-        try:
-            result = subprocess.run(
-                ["docker", "logs", "ps"],
-                capture_output=True, text=True, timeout=10
-            )
-            ps_logs = result.stdout
-        except Exception as e:
-            print(f"WARNING: Error obteniendo logs del PS: {e}")
-            ps_logs = ""
+        inicio_ps = _inicio_contenedor("ps")
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            futuro_ps = executor.submit(_docker_logs, "ps", inicio_ps)
+            futuro_gc = executor.submit(_docker_logs, "gc", inicio_ps)
+            ps_logs = futuro_ps.result()
+            gc_logs = futuro_gc.result()
         
         # Contar operaciones procesadas en logs
-        solicitudes_enviadas = ps_logs.count("Solicitud #")
-        solicitudes_exitosas = ps_logs.count("Solicitud procesada exitosamente")
-        solicitudes_error = ps_logs.count("Error en solicitud")
+        conteo_ps = Counter(m.lastgroup for m in PS_PAT.finditer(ps_logs))
+        solicitudes_enviadas = conteo_ps['enviadas']
+        solicitudes_exitosas = conteo_ps['exitosas']
+        solicitudes_error = conteo_ps['error']
         
         self.resultados["solicitudes_procesadas"] = solicitudes_enviadas
         self.resultados["operaciones_ok"] = solicitudes_exitosas
@@ -148,20 +221,12 @@ class TestFileWorkload:
         
         # 6. Analizar logs del GC
         print("Analizando logs del GC...")
-        try:
-            result = subprocess.run(
-                ["docker", "logs", "gc"],
-                capture_output=True, text=True, timeout=10
-            )
-            gc_logs = result.stdout
-        except Exception as e:
-            print(f"WARNING: Error obteniendo logs del GC: {e}")
-            gc_logs = ""
         
         # Contar operaciones en logs del GC
-        operaciones_gc = gc_logs.count("Operación #")
-        publicaciones_devolucion = gc_logs.count("Topic: devolucion")
-        publicaciones_renovacion = gc_logs.count("Topic: renovacion")
+        conteo_gc = Counter(m.lastgroup for m in GC_PAT.finditer(gc_logs))
+        operaciones_gc = conteo_gc['operaciones']
+        publicaciones_devolucion = conteo_gc['devolucion']
+        publicaciones_renovacion = conteo_gc['renovacion']
         
         print(f"Operaciones en logs del GC:")
         print(f"   - Total procesadas: {operaciones_gc}")
@@ -169,18 +234,18 @@ class TestFileWorkload:
         print(f"   - Publicaciones renovación: {publicaciones_renovacion}")
         
         # 7. Validar que se procesaron todas las solicitudes
-        assert solicitudes_enviadas >= len(solicitudes), \
-            f"PS no procesó todas las solicitudes: {solicitudes_enviadas} < {len(solicitudes)}"
+        assert solicitudes_enviadas >= total_solicitudes, \
+            f"PS no procesó todas las solicitudes: {solicitudes_enviadas} < {total_solicitudes}"
         
-        assert operaciones_gc >= len(solicitudes), \
-            f"GC no procesó todas las solicitudes: {operaciones_gc} < {len(solicitudes)}"
+        assert operaciones_gc >= total_solicitudes, \
+            f"GC no procesó todas las solicitudes: {operaciones_gc} < {total_solicitudes}"
         
         # 8. Validar publicaciones por tema
-        assert publicaciones_devolucion >= len(devoluciones), \
-            f"Faltan publicaciones de devolución: {publicaciones_devolucion} < {len(devoluciones)}"
+        assert publicaciones_devolucion >= total_devoluciones, \
+            f"Faltan publicaciones de devolución: {publicaciones_devolucion} < {total_devoluciones}"
         
-        assert publicaciones_renovacion >= len(renovaciones), \
-            f"Faltan publicaciones de renovación: {publicaciones_renovacion} < {len(renovaciones)}"
+        assert publicaciones_renovacion >= total_renovaciones, \
+            f"Faltan publicaciones de renovación: {publicaciones_renovacion} < {total_renovaciones}"
         
         print("Todas las solicitudes fueron procesadas correctamente")
         
@@ -190,22 +255,23 @@ class TestFileWorkload:
         # Esperar un momento para que los actores procesen
         time.sleep(2)
         
-        libros_final = TestUtils.read_json(self.libros_path)
+        campos_final = _campos_por_libro(TestUtils.read_json(self.libros_path))
         
-        # Verificar que hubo cambios
-        if libros_final != libros_inicial:
+        # Verificar que hubo cambios (solo se comparan los campos indexados por libro_id)
+        if campos_final != campos_inicial:
             self.resultados["cambios_en_libros"] = True
             print("Se detectaron cambios en la base de datos")
             
             # Mostrar diferencias
             print("Cambios detectados:")
-            for i, (libro_inicial, libro_final) in enumerate(zip(libros_inicial, libros_final)):
-                if libro_inicial != libro_final:
-                    print(f"   Libro {libro_final.get('libro_id', 'N/A')}:")
-                    if libro_inicial.get('ejemplares_disponibles') != libro_final.get('ejemplares_disponibles'):
-                        print(f"     Ejemplares: {libro_inicial.get('ejemplares_disponibles')} -> {libro_final.get('ejemplares_disponibles')}")
-                    if libro_inicial.get('fecha_devolucion') != libro_final.get('fecha_devolucion'):
-                        print(f"     Fecha: {libro_inicial.get('fecha_devolucion')} -> {libro_final.get('fecha_devolucion')}")
+            for libro_id, (ejemplares_fin, fecha_fin) in campos_final.items():
+                ejemplares_ini, fecha_ini = campos_inicial.get(libro_id, (None, None))
+                if (ejemplares_ini, fecha_ini) != (ejemplares_fin, fecha_fin):
+                    print(f"   Libro {libro_id if libro_id is not None else 'N/A'}:")
+                    if ejemplares_ini != ejemplares_fin:
+                        print(f"     Ejemplares: {ejemplares_ini} -> {ejemplares_fin}")
+                    if fecha_ini != fecha_fin:
+                        print(f"     Fecha: {fecha_ini} -> {fecha_fin}")
         else:
             print("WARNING: No se detectaron cambios en la base de datos")
         
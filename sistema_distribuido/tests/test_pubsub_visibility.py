@@ -5,9 +5,7 @@ Valida que los eventos se publiquen correctamente en los topics correspondientes
 """
 
 import pytest
-import time
 import json
-import os
 from datetime import datetime
 from tests.test_utils import TestUtils, SubscriberTester
 
@@ -20,9 +18,6 @@ class TestPubSubVisibility:
         self.gc_pub_endpoint = "tcp://gc:5002"
         self.logs_path = "logs/test_pubsub_visibility.txt"
         
-        # Crear directorio de logs si no existe
-        os.makedirs("logs", exist_ok=True)
-        
         # Resultados del test
         self.resultados = {
             "test_name": "test_pubsub_visibility",
@@ -63,7 +58,7 @@ class TestPubSubVisibility:
         
         # 4. Esperar evento con timeout
         print("Esperando evento de devolución...")
-        time.sleep(3)  # Dar tiempo para procesamiento asíncrono
+        subscriber.wait_for_event("devolucion", timeout=5)  # Retorna en cuanto llega el evento
         
         # 5. Validar recepción de evento
         eventos_devolucion = subscriber.obtener_eventos("DEVOLUCION")
@@ -124,7 +119,7 @@ class TestPubSubVisibility:
         
         # 4. Esperar evento con timeout
         print("Esperando evento de renovación...")
-        time.sleep(3)  # Dar tiempo para procesamiento asíncrono
+        subscriber.wait_for_event("renovacion", timeout=5)  # Retorna en cuanto llega el evento
         
         # 5. Validar recepción de evento
         eventos_renovacion = subscriber.obtener_eventos("RENOVACION")
@@ -199,7 +194,8 @@ class TestPubSubVisibility:
         
         # 4. Esperar eventos
         print("Esperando eventos...")
-        time.sleep(3)
+        subscriber.wait_for_event("devolucion", timeout=5)
+        subscriber.wait_for_event("renovacion", timeout=5)
         
         # 5. Validar recepción de ambos eventos
         eventos_devolucion = subscriber.obtener_eventos("DEVOLUCION")
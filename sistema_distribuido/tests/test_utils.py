@@ -4,9 +4,11 @@ Utilidades comunes para los tests del sistema distribuido
 """
 
 import zmq
-import json
+import atexit
+import orjson
 import time
 import os
+import shutil
 import threading
 from datetime import datetime, timedelta
 from typing import Dict, Any, Tuple, Optional, Callable
@@ -16,6 +18,13 @@ import logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Contexto ZMQ compartido por las solicitudes de los tests: cada send_req solo crea su socket
+_CTX = zmq.Context.instance()
+atexit.register(_CTX.term)
+
+# Directorio de reportes y snapshots: se crea una vez al importar, no en cada setup_method
+os.makedirs("logs", exist_ok=True)
+
 class TestUtils:
     """Utilidades para testing del sistema distribuido"""
     
@@ -27,6 +36,28 @@ class TestUtils:
         logger.info(f"Esperando {sleep_time}s para slow joiner de ZeroMQ...")
         time.sleep(sleep_time)
     
+    @staticmethod
+    def wait_until(pred: Callable[[], bool], timeout: float = 5.0,
+                   interval: float = 0.02) -> bool:
+        """
+        Espera hasta que pred() sea verdadero, revisando cada interval segundos
+        
+        Args:
+            pred: Condición a evaluar
+            timeout: Tiempo máximo de espera en segundos
+            interval: Pausa entre evaluaciones en segundos
+            
+        Returns:
+            True si la condición se cumplió dentro del timeout
+        """
+        limite = time.monotonic() + timeout
+        while True:
+            if pred():
+                return True
+            if time.monotonic() >= limite:
+                return False
+            time.sleep(interval)
+    
     @staticmethod
     def send_req(gc_endpoint: str, payload: Dict[str, Any]) -> Tuple[str, float]:
         """
@@ -39,29 +70,47 @@ class TestUtils:
         Returns:
             Tuple[status, ack_ms]: Status de respuesta y tiempo en ms
         """
-        context = zmq.Context()
-        socket = context.socket(zmq.REQ)
+        return TestUtils.send_req_bytes(gc_endpoint, orjson.dumps(payload))
+    
+    @staticmethod
+    def send_req_bytes(gc_endpoint: str, body: bytes) -> Tuple[str, float]:
+        """
+        Envía al GC una solicitud ya serializada y mide tiempo de respuesta
+        
+        Args:
+            gc_endpoint: Endpoint del GC (ej: "tcp://gc:5001")
+            body: Solicitud serializada en JSON (p. ej. orjson.dumps(payload))
+            
+        Returns:
+            Tuple[status, ack_ms]: Status de respuesta y tiempo en ms
+        """
+        socket = _CTX.socket(zmq.REQ)
+        socket.setsockopt(zmq.LINGER, 0)  # No bloquear el cierre con la solicitud pendiente
+        # Sin GC (IMMEDIATE bloquea el envío) o sin respuesta, falla en vez de colgarse
+        socket.setsockopt(zmq.SNDTIMEO, 5000)
+        socket.setsockopt(zmq.RCVTIMEO, 5000)
+        socket.setsockopt(zmq.TCP_KEEPALIVE, 1)
+        socket.setsockopt(zmq.IMMEDIATE, 1)  # Encolar solo en conexiones ya establecidas
         
         try:
             socket.connect(gc_endpoint)
             
             # Medir tiempo de respuesta
             start_time = time.time()
-            socket.send(json.dumps(payload, ensure_ascii=False).encode('utf-8'))
+            socket.send(body, copy=False)
             response_bytes = socket.recv()
             end_time = time.time()
             
             ack_ms = (end_time - start_time) * 1000
-            response = json.loads(response_bytes.decode('utf-8'))
+            response = orjson.loads(response_bytes)
             
-            logger.info(f"REQ enviado: {payload}")
+            logger.info(f"REQ enviado: {body.decode('utf-8')}")
             logger.info(f"RES recibida: {response} (took {ack_ms:.2f}ms)")
             
             return response.get('status', 'UNKNOWN'), ack_ms
             
         finally:
             socket.close()
-            context.term()
     
     @staticmethod
     def read_json(path: str) -> Dict[str, Any]:
@@ -75,15 +124,24 @@ class TestUtils:
             Dict con el contenido del JSON
         """
         try:
-            with open(path, 'r', encoding='utf-8') as f:
-                return json.load(f)
+            # Bytes directos a orjson: sin TextIOWrapper ni el parser de json de la stdlib
+            with open(path, 'rb') as f:
+                return orjson.loads(f.read())
         except FileNotFoundError:
             logger.warning(f"Archivo no encontrado: {path}")
             return {}
-        except json.JSONDecodeError as e:
+        except orjson.JSONDecodeError as e:
             logger.error(f"Error parseando JSON {path}: {e}")
             return {}
     
+    @staticmethod
+    def _mtime_ns(path: str) -> Optional[int]:
+        """mtime del archivo en nanosegundos, o None si no existe"""
+        try:
+            return os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            return None
+    
     @staticmethod
     def wait_for_file_change(path: str, predicate: Callable[[Dict], bool], 
                            timeout: float = 10.0) -> bool:
@@ -101,9 +159,16 @@ class TestUtils:
         logger.info(f"Esperando cambio en {path} (timeout: {timeout}s)")
         
         start_time = time.time()
+        last_mtime = TestUtils._mtime_ns(path)
         initial_content = TestUtils.read_json(path)
         
         while time.time() - start_time < timeout:
+            # Solo se vuelve a parsear el JSON cuando cambia el mtime del archivo
+            mtime = TestUtils._mtime_ns(path)
+            if mtime == last_mtime:
+                time.sleep(0.1)
+                continue
+            last_mtime = mtime
             current_content = TestUtils.read_json(path)
             
             if current_content != initial_content:
@@ -123,14 +188,25 @@ class TestUtils:
         """
         Crea snapshot del archivo libros.json
         
+        Copia los bytes tal cual (sin parsear ni re-serializar) y conserva el mtime del
+        original, así que si el snapshot ya corresponde a esa versión no se vuelve a copiar.
+        No se usa un hardlink porque el GA reescribe libros.json sobre el mismo inodo.
+        
         Args:
             path: Ruta al archivo original
             snapshot_path: Ruta donde guardar el snapshot
         """
         try:
-            libros = TestUtils.read_json(path)
-            with open(snapshot_path, 'w', encoding='utf-8') as f:
-                json.dump(libros, f, ensure_ascii=False, indent=2)
+            origen = os.stat(path)
+            try:
+                destino = os.stat(snapshot_path)
+                if (destino.st_mtime_ns == origen.st_mtime_ns
+                        and destino.st_size == origen.st_size):
+                    logger.info(f"Snapshot vigente, sin cambios: {snapshot_path}")
+                    return
+            except FileNotFoundError:
+                pass
+            shutil.copy2(path, snapshot_path)
             logger.info(f"Snapshot creado: {snapshot_path}")
         except Exception as e:
             logger.error(f"Error creando snapshot: {e}")
@@ -189,14 +265,18 @@ class TestUtils:
             log_path: Ruta donde guardar el reporte
         """
         try:
+            # El reporte se arma completo y se escribe con un solo write()
+            lineas = [
+                f"=== REPORTE DE TEST: {test_name} ===",
+                f"Timestamp: {datetime.now().isoformat()}",
+                ""
+            ]
+            lineas.extend(f"{key}: {value}" for key, value in resultados.items())
+            lineas.append("")
+            lineas.append(f"Estado: {'PASSED' if resultados.get('passed', False) else 'FAILED'}")
+            
             with open(log_path, 'w', encoding='utf-8') as f:
-                f.write(f"=== REPORTE DE TEST: {test_name} ===\n")
-                f.write(f"Timestamp: {datetime.now().isoformat()}\n\n")
-                
-                for key, value in resultados.items():
-                    f.write(f"{key}: {value}\n")
-                
-                f.write(f"\nEstado: {'PASSED' if resultados.get('passed', False) else 'FAILED'}\n")
+                f.write("\n".join(lineas) + "\n")
             
             logger.info(f"Reporte guardado: {log_path}")
             
@@ -209,16 +289,30 @@ class SubscriberTester:
     def __init__(self, gc_endpoint: str = "tcp://gc:5002"):
         self.context = zmq.Context()
         self.socket = self.context.socket(zmq.SUB)
+        self.socket.setsockopt(zmq.LINGER, 0)  # Cierre inmediato en detener()
+        self.socket.setsockopt(zmq.TCP_KEEPALIVE, 1)
         self.gc_endpoint = gc_endpoint
         self.events_received = []
-        self.running = False
+        # Los mismos eventos indexados por operación al recibirlos: obtener_eventos(op) no
+        # recorre todo el historial. Son listas (copia atómica bajo el GIL), no deques
+        self._eventos_por_operacion = {}
         self.thread = None
+        # La espera de eventos se bloquea en el poller, no en un bucle con sleep
+        self.poller = zmq.Poller()
+        self.poller.register(self.socket, zmq.POLLIN)
+        self._stop_event = threading.Event()
+        # Un Event por topic suscrito, que _escuchar activa al recibir el primer evento
+        self._events_ready = {}
+        # Topics suscritos ya codificados, para no decodificar el frame de topic en cada mensaje
+        self._topic_bytes = {}
     
     def conectar(self, topics: list) -> None:
         """Conecta y suscribe a topics"""
         self.socket.connect(self.gc_endpoint)
         
         for topic in topics:
+            self._events_ready.setdefault(topic, threading.Event())
+            self._topic_bytes[topic.encode('utf-8')] = topic
             self.socket.setsockopt(zmq.SUBSCRIBE, topic.encode('utf-8'))
             logger.info(f"Suscrito a topic: {topic}")
         
@@ -227,19 +321,26 @@ class SubscriberTester:
     
     def iniciar_escucha(self) -> None:
         """Inicia escucha en thread separado"""
-        self.running = True
+        self._stop_event.clear()
         self.thread = threading.Thread(target=self._escuchar)
         self.thread.start()
         logger.info("Iniciada escucha de eventos")
     
     def _escuchar(self) -> None:
         """Loop de escucha de eventos"""
-        while self.running:
+        while not self._stop_event.is_set():
             try:
-                mensaje = self.socket.recv_multipart(zmq.NOBLOCK)
-                if len(mensaje) >= 2:
-                    topic = mensaje[0].decode('utf-8')
-                    datos = json.loads(mensaje[1].decode('utf-8'))
+                # Timeout corto para revisar periódicamente la señal de parada
+                socks = dict(self.poller.poll(100))
+                if self.socket not in socks:
+                    continue
+                # Frames sin copia: orjson parsea directamente el buffer de cada evento
+                mensaje = self.socket.recv_multipart(copy=False)
+                # Un mensaje puede traer varios eventos del mismo topic (GC_PUB_BATCH=1)
+                topic_bytes = mensaje[0].bytes
+                topic = self._topic_bytes.get(topic_bytes) or topic_bytes.decode('utf-8')
+                for frame in mensaje[1:]:
+                    datos = orjson.loads(frame.buffer)
                     
                     evento = {
                         'topic': topic,
@@ -248,17 +349,20 @@ class SubscriberTester:
                     }
                     
                     self.events_received.append(evento)
+                    self._eventos_por_operacion.setdefault(datos.get('operacion'), []).append(evento)
                     logger.info(f"Evento recibido: {topic} - {datos.get('operacion', 'N/A')}")
                 
-            except zmq.Again:
-                time.sleep(0.01)
+                listo = self._events_ready.get(topic)
+                if listo is not None:
+                    listo.set()
+                
             except Exception as e:
                 logger.error(f"Error en escucha: {e}")
                 break
     
     def detener(self) -> None:
         """Detiene la escucha"""
-        self.running = False
+        self._stop_event.set()
         if self.thread:
             self.thread.join(timeout=2)
         
@@ -266,8 +370,24 @@ class SubscriberTester:
         self.context.term()
         logger.info("Escucha detenida")
     
+    def wait_for_event(self, topic: str, timeout: float = 5.0) -> bool:
+        """
+        Espera hasta recibir al menos un evento del topic
+        
+        Args:
+            topic: Topic suscrito en conectar()
+            timeout: Tiempo máximo de espera en segundos
+            
+        Returns:
+            True si llegó algún evento del topic dentro del timeout
+        """
+        listo = self._events_ready.get(topic)
+        if listo is None:
+            raise ValueError(f"No hay suscripción al topic: {topic}")
+        return listo.wait(timeout)
+    
     def obtener_eventos(self, operacion: str = None) -> list:
         """Obtiene eventos recibidos, opcionalmente filtrados por operación"""
         if operacion:
-            return [e for e in self.events_received if e['data'].get('operacion') == operacion]
+            return self._eventos_por_operacion.get(operacion, []).copy()
         return self.events_received.copy()
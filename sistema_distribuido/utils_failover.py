@@ -6,7 +6,7 @@ Funciones para health checks y conmutación entre réplicas
 """
 
 import zmq
-import json
+import orjson
 import time
 import logging
 import os
@@ -16,6 +16,10 @@ logger = logging.getLogger(__name__)
 class FailoverManager:
     """Gestiona el failover entre réplicas primaria y secundaria"""
     
+    # Operaciones que no se pueden repetir sin efecto adicional: si el GA pudo recibirlas,
+    # enviar_lote no las reintenta (p. ej. RETURN_BOOK devolvería un segundo ejemplar)
+    OPERACIONES_NO_IDEMPOTENTES = frozenset({"RETURN_BOOK", "LOAN_BOOK"})
+    
     def __init__(self, ga_host="ga", ga_port=5003, timeout=5, retry_interval=30):
         """
         Inicializa el gestor de failover
@@ -34,6 +38,9 @@ class FailoverManager:
         self.last_health_check = None
         self.context = None
         self.ga_socket = None
+        # DEALER para lotes en pipelining (enviar_lote); el REQ sigue para operaciones sueltas
+        self.ga_dealer = None
+        self._id_lote = 0
     
     def crear_socket_ga(self):
         """Crea un socket REQ para comunicarse con GA"""
@@ -46,6 +53,10 @@ class FailoverManager:
         self.ga_socket = self.context.socket(zmq.REQ)
         self.ga_socket.setsockopt(zmq.RCVTIMEO, self.timeout * 1000)  # Timeout en ms
         self.ga_socket.setsockopt(zmq.LINGER, 0)
+        # Un health check con timeout no deja el REQ esperando recv: el siguiente envío
+        # funciona (RELAXED) y la respuesta tardía se descarta (CORRELATE)
+        self.ga_socket.setsockopt(zmq.REQ_RELAXED, 1)
+        self.ga_socket.setsockopt(zmq.REQ_CORRELATE, 1)
         
         ga_address = f"tcp://{self.ga_host}:{self.ga_port}"
         self.ga_socket.connect(ga_address)
@@ -68,12 +79,10 @@ class FailoverManager:
                 "operacion": "HEALTH_CHECK"
             }
             
-            self.ga_socket.send(json.dumps(solicitud).encode('utf-8'))
+            self.ga_socket.send(orjson.dumps(solicitud))
             
             # Recibir respuesta
-            respuesta_bytes = self.ga_socket.recv()
-            respuesta_str = respuesta_bytes.decode('utf-8')
-            respuesta = json.loads(respuesta_str)
+            respuesta = orjson.loads(self.ga_socket.recv())
             
             self.last_health_check = time.time()
             self.using_primary = True
@@ -145,12 +154,10 @@ class FailoverManager:
                     self.crear_socket_ga()
                 
                 # Enviar solicitud
-                self.ga_socket.send(json.dumps(solicitud).encode('utf-8'))
+                self.ga_socket.send(orjson.dumps(solicitud))
                 
                 # Recibir respuesta
-                respuesta_bytes = self.ga_socket.recv()
-                respuesta_str = respuesta_bytes.decode('utf-8')
-                respuesta = json.loads(respuesta_str)
+                respuesta = orjson.loads(self.ga_socket.recv())
                 
                 self.last_health_check = time.time()
                 self.using_primary = True
@@ -160,8 +167,7 @@ class FailoverManager:
             except zmq.Again:
                 logger.warning(f"Timeout en operación {operacion} (intento {intento + 1}/{max_retries})")
                 if intento < max_retries - 1:
-                    time.sleep(1)  # Esperar antes de reintentar
-                    self.crear_socket_ga()  # Recrear socket
+                    time.sleep(1)  # Esperar antes de reintentar (REQ_RELAXED permite reenviar por el mismo socket)
                 else:
                     logger.error(f"Fallo definitivo en operación {operacion} después de {max_retries} intentos")
                     self.using_primary = False
@@ -185,6 +191,102 @@ class FailoverManager:
         
         return None
     
+    def crear_dealer_ga(self):
+        """Crea el socket DEALER con el que enviar_lote habla con el REP del GA"""
+        if not self.context:
+            self.context = zmq.Context()
+        
+        if self.ga_dealer:
+            self.ga_dealer.close()
+        
+        self.ga_dealer = self.context.socket(zmq.DEALER)
+        # LINGER 0: al cerrar se descarta lo encolado, que así no se entrega más tarde al GA
+        self.ga_dealer.setsockopt(zmq.LINGER, 0)
+        # IMMEDIATE: sin conexión con el GA el envío falla (SNDTIMEO) en vez de encolar el
+        # lote para reproducirlo al reconectar
+        self.ga_dealer.setsockopt(zmq.IMMEDIATE, 1)
+        self.ga_dealer.setsockopt(zmq.SNDTIMEO, self.timeout * 1000)
+        ga_address = f"tcp://{self.ga_host}:{self.ga_port}"
+        self.ga_dealer.connect(ga_address)
+        
+        logger.info(f"Socket DEALER GA creado: {ga_address}")
+    
+    def enviar_lote(self, operaciones):
+        """
+        Envía varias operaciones al GA sin esperar cada respuesta (pipelining)
+        
+        DEALER habla con el REP del GA sin cambios en el servidor: cada operación va en el
+        sobre [id, b'', payload] y REP lo devuelve intacto con la respuesta. Si alguna queda
+        sin respuesta dentro del timeout, el DEALER se cierra (descartando lo encolado) y se
+        recrea en el próximo lote. Las pendientes que nunca se enviaron, o que son
+        idempotentes, se reintentan una a una con enviar_operacion; las no idempotentes que
+        el GA pudo recibir se reportan como fallidas para no ejecutarlas dos veces.
+        
+        Args:
+            operaciones: Lista de (operacion, datos)
+        
+        Returns:
+            Lista con la respuesta del GA (o None si falla) de cada operación, en el mismo orden
+        """
+        resultados = [None] * len(operaciones)
+        pendientes = {}  # id -> índice en operaciones
+        enviadas = set()  # ids que el DEALER aceptó y que el GA pudo haber recibido
+        
+        try:
+            if not self.ga_dealer:
+                self.crear_dealer_ga()
+            
+            envios = []
+            for indice, (operacion, datos) in enumerate(operaciones):
+                self._id_lote += 1
+                id_operacion = b'%d' % self._id_lote
+                solicitud = {
+                    "operacion": operacion,
+                    **datos
+                }
+                envios.append((id_operacion, orjson.dumps(solicitud)))
+                pendientes[id_operacion] = indice
+            
+            for id_operacion, mensaje in envios:
+                self.ga_dealer.send_multipart([id_operacion, b'', mensaje])
+                enviadas.add(id_operacion)
+            
+            while pendientes:
+                if not self.ga_dealer.poll(self.timeout * 1000):
+                    logger.warning(f"Timeout en lote: {len(pendientes)} operaciones sin respuesta")
+                    break
+                # Respuesta: [id, b'', payload]
+                frames = self.ga_dealer.recv_multipart()
+                indice = pendientes.pop(frames[0], None)
+                if indice is None:
+                    continue
+                resultados[indice] = orjson.loads(frames[-1])
+            
+            if len(pendientes) < len(operaciones):
+                self.last_health_check = time.time()
+                self.using_primary = True
+        
+        except Exception as e:
+            logger.error(f"Error enviando lote al GA: {e}")
+        
+        if not pendientes:
+            return resultados
+        
+        # Cerrar el DEALER descarta lo que siga encolado; el próximo lote lo recrea
+        if self.ga_dealer:
+            self.ga_dealer.close()
+            self.ga_dealer = None
+        
+        for id_operacion, indice in sorted(pendientes.items(), key=lambda item: item[1]):
+            operacion, datos = operaciones[indice]
+            if id_operacion in enviadas and operacion in self.OPERACIONES_NO_IDEMPOTENTES:
+                logger.error(f"Operación {operacion} sin respuesta del GA: no se reintenta "
+                             f"porque pudo haberse aplicado")
+                continue
+            resultados[indice] = self.enviar_operacion(operacion, datos)
+        
+        return resultados
+    
     def verificar_y_reconectar(self):
         """Verifica la conexión y reconecta si es necesario"""
         if self.last_health_check is None or (time.time() - self.last_health_check) > self.retry_interval:
@@ -201,6 +303,9 @@ class FailoverManager:
         if self.ga_socket:
             self.ga_socket.close()
             self.ga_socket = None
+        if self.ga_dealer:
+            self.ga_dealer.close()
+            self.ga_dealer = None
         if self.context:
             self.context.term()
             self.context = None
@@ -217,26 +322,26 @@ def verificar_ga_disponible(ga_host="ga", ga_port=5003, timeout=5):
     Returns:
         bool: True si GA está disponible, False en caso contrario
     """
+    socket = None
     try:
-        context = zmq.Context()
-        socket = context.socket(zmq.REQ)
+        # Contexto compartido del proceso: cada verificación solo crea y cierra su socket
+        socket = zmq.Context.instance().socket(zmq.REQ)
         socket.setsockopt(zmq.RCVTIMEO, timeout * 1000)
         socket.setsockopt(zmq.LINGER, 0)
         
         socket.connect(f"tcp://{ga_host}:{ga_port}")
         
         solicitud = {"operacion": "HEALTH_CHECK"}
-        socket.send(json.dumps(solicitud).encode('utf-8'))
-        
-        respuesta_bytes = socket.recv()
-        respuesta = json.loads(respuesta_bytes.decode('utf-8'))
+        socket.send(orjson.dumps(solicitud))
         
-        socket.close()
-        context.term()
+        respuesta = orjson.loads(socket.recv())
         
         return respuesta.get('status') in ['healthy', 'degraded']
     
     except Exception as e:
         logger.debug(f"GA no disponible: {e}")
         return False
+    finally:
+        if socket is not None:
+            socket.close()
 
@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Utilidades de Logging - Sistema Distribuido de Préstamo de Libros
+Configuración común de logging para los procesos del sistema
+"""
+
+import atexit
+import logging
+import queue
+from logging.handlers import QueueHandler, QueueListener
+
+_log_listener = None
+
+def configurar_logging(componente, nivel='INFO'):
+    """
+    Configura el logging del proceso con un QueueListener
+
+    Los registros se encolan y el listener los escribe en un thread aparte, de modo
+    que la E/S de logs sale del camino de las solicitudes. Se llama desde main():
+    importar los módulos (p. ej. desde las pruebas) no arranca ningún thread.
+
+    Args:
+        componente: Nombre corto del proceso que aparece en cada línea (GA, GC, PS...)
+        nivel: Nivel de logging (nombre o número)
+
+    Returns:
+        El QueueListener del proceso (el mismo si ya estaba configurado)
+    """
+    global _log_listener
+    if _log_listener is not None:
+        return _log_listener
+
+    log_queue = queue.SimpleQueue()
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter(
+        f'%(asctime)s - {componente} - %(levelname)s - %(message)s',
+        datefmt='%Y-%m-%d %H:%M:%S'
+    ))
+    _log_listener = QueueListener(log_queue, handler)
+    _log_listener.start()
+    atexit.register(_log_listener.stop)
+    logging.basicConfig(
+        level=nivel.upper() if isinstance(nivel, str) else nivel,
+        format='%(message)s',  # El formato completo lo aplica el handler en el listener
+        handlers=[QueueHandler(log_queue)]
+    )
+    return _log_listener